@@ -12,27 +12,46 @@ import os
 from datetime import datetime
 import aiofiles
 import aiohttp
-from config import TELEGRAM_BOT_TOKEN, MEDIA_DIR, OUTPUT_DIR, WECHAT_ACCESS_TOKEN, WECHAT_APPID
+from config import (
+    TELEGRAM_BOT_TOKEN, MEDIA_DIR, OUTPUT_DIR, WECHAT_ACCESS_TOKEN, WECHAT_APPID,
+    STICKER_WORKERS, STICKER_QUEUE_SIZE, STICKER_TIMEOUT,
+    STICKER_MAX_WIDTH, STICKER_FPS, STICKER_MAX_BYTES, STICKER_MAX_FRAMES,
+    MEDIA_CACHE_DIR, MEDIA_CACHE_MAX_BYTES, MEDIA_CACHE_TTL,
+    HTTP_LIMIT, HTTP_LIMIT_PER_HOST, HTTP_DNS_TTL, HTTP_TIMEOUT, HTTP_CONNECT_TIMEOUT,
+    WECHAT_UPLOAD_CONCURRENCY, WECHAT_UPLOAD_RETRIES, WECHAT_TOKEN_CACHE,
+    UPLOAD_RETRIES, UPLOAD_BACKOFF, UPLOAD_BACKOFF_MAX, TELEGRAPH_PAGE_CONCURRENCY,
+    CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_TIMEOUT,
+    MEDIA_PIPELINE_WORKERS, ALBUM_WINDOW, CONCURRENT_UPDATES, STREAM_CHUNK_SIZE, STREAM_SPILL_THRESHOLD,
+    SESSION_STORE, SESSION_DB,
+    TEMPLATE_CACHE_DIR, TEMPLATE_COMPILED_DIR, TEMPLATE_AUTO_RELOAD,
+    BOT_MODE, WEBHOOK_URL, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET_TOKEN, WEBHOOK_HEALTH_PATH
+)
 from utils.file_handler import FileHandler
 from telegraph import Telegraph
 import asyncio
-from extend.wechat import Wechat
+import functools
+import signal
+import mimetypes
+from extend.wechat import AsyncWechat, WechatTokenExpiredError, WechatTokenManager
 from utils.telegraph_handler import TelegraphHandler
 import tempfile
-from PIL import Image
 import io
 from utils.template_manager import TemplateManager
-import PIL
-import lottie
-from lottie import parsers
-from lottie import exporters
+from utils.sticker_converter import StickerConverter
+from utils.media_cache import MediaCache
+from utils.http_client import HttpClient
+from utils.media_pipeline import MediaPipeline
+from utils.album_aggregator import AlbumAggregator
+from utils.chat_sequencer import ChatSequencer, Slot
+from utils.webhook_server import WebhookServer
+from utils.session_store import create_session_store
+from utils.recorded_message import RecordedMessage
+from utils.telegraph_publisher import TelegraphPublisher
+from utils.publisher import Publisher, TelegraphBackend, TelegramFileBackend, WechatBackend
+from utils.resilience import CONNECT_ERRORS, CircuitBreakerRegistry, DownloadError, call_with_retry
 import subprocess
-import imageio
-import numpy
 from dotenv import load_dotenv
-from io import BytesIO
 import json
-import requests
 
 # 加载 .env 文件中的环境变量
 load_dotenv()
@@ -44,8 +63,8 @@ CHAT_ID = os.getenv("CHAT_ID")
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# 用于存储消息的字典，key是chat_id
-message_store = {}
+# 记录会话的存储，key是chat_id，默认持久化到 SQLite，重启后可继续记录
+session_store = create_session_store(SESSION_STORE, SESSION_DB)
 
 # 初始化文件处理器
 file_handler = FileHandler(MEDIA_DIR)
@@ -57,6 +76,73 @@ telegraph.create_account(short_name='message_recorder_bot')
 # 确保目录存在
 os.makedirs(MEDIA_DIR, exist_ok=True)
 
+# 按 file_unique_id 缓存转换结果和上传地址
+media_cache = MediaCache(MEDIA_CACHE_DIR, MEDIA_CACHE_MAX_BYTES, MEDIA_CACHE_TTL)
+
+# 贴纸转码引擎（进程池），在 post_shutdown 中关闭；TGS 渲染帧也保存在媒体缓存中
+sticker_converter = StickerConverter(
+    STICKER_WORKERS, STICKER_QUEUE_SIZE, STICKER_TIMEOUT, STICKER_MAX_BYTES, STICKER_MAX_FRAMES,
+    render_cache=media_cache
+)
+
+# 共享的 HTTP 连接池，在 post_init 中创建
+http_client = HttpClient(
+    limit=HTTP_LIMIT,
+    limit_per_host=HTTP_LIMIT_PER_HOST,
+    dns_ttl=HTTP_DNS_TTL,
+    total_timeout=HTTP_TIMEOUT,
+    connect_timeout=HTTP_CONNECT_TIMEOUT
+)
+
+# 微信图片上传的全局并发限制
+wechat_upload_semaphore = asyncio.Semaphore(WECHAT_UPLOAD_CONCURRENCY)
+
+# 记录过程中的后台媒体预处理
+media_pipeline = MediaPipeline(MEDIA_PIPELINE_WORKERS)
+
+# 按 media_group_id 聚合相册图片
+album_aggregator = AlbumAggregator(session_store, media_pipeline, ALBUM_WINDOW)
+
+# 按会话保持消息顺序，允许并发处理 update
+chat_sequencer = ChatSequencer(session_store)
+
+# 共享的模板管理器，模板在启动时编译一次
+template_manager = TemplateManager(
+    bytecode_cache_dir=TEMPLATE_CACHE_DIR,
+    compiled_dir=TEMPLATE_COMPILED_DIR,
+    auto_reload=TEMPLATE_AUTO_RELOAD
+)
+
+# 进程级共享的微信 access_token，持久化后重启可复用
+wechat_token_manager = WechatTokenManager(WECHAT_ACCESS_TOKEN, WECHAT_APPID, WECHAT_TOKEN_CACHE)
+
+# 按上游主机共享的熔断器，上游故障时快速失败，避免大量协程堆积在重试中
+circuit_breakers = CircuitBreakerRegistry(CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_TIMEOUT)
+
+# Telegraph 文章发布器，限制并发页面请求，与图床共用 telegra.ph 的熔断器
+telegraph_publisher = TelegraphPublisher(
+    telegraph,
+    concurrency=TELEGRAPH_PAGE_CONCURRENCY,
+    retries=UPLOAD_RETRIES,
+    backoff=UPLOAD_BACKOFF,
+    max_backoff=UPLOAD_BACKOFF_MAX,
+    breaker=circuit_breakers.get(TelegraphBackend.host)
+)
+
+# 媒体发布引擎，统一各上传目标的重试、退避、熔断和统计
+publisher = Publisher(
+    [
+        TelegraphBackend(http_client),
+        TelegramFileBackend(http_client, TELEGRAM_BOT_TOKEN, CHAT_ID),
+        WechatBackend(http_client, WECHAT_ACCESS_TOKEN, WECHAT_APPID, wechat_token_manager,
+                      semaphore=wechat_upload_semaphore),
+    ],
+    retries=UPLOAD_RETRIES,
+    backoff=UPLOAD_BACKOFF,
+    max_backoff=UPLOAD_BACKOFF_MAX,
+    breakers=circuit_breakers
+)
+
 async def unknown(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("抱歉，我无法理解您的命令或您无权访问该功能。")
 
@@ -72,160 +158,321 @@ async def restrict_access(update: Update) -> bool:
     return True
 
 
-async def upload_to_telegraph(html_content: str) -> str:
-    """上传内容到 Telegraph 并返回链接"""
-    formatted_content = html_content.replace('<html>', '').replace('</html>', '')
-    formatted_content = formatted_content.replace('<body>', '').replace('</body>', '')
-    
-    response = await asyncio.to_thread(
-        telegraph.create_page,
-        title='消息记录',
-        html_content=formatted_content
-    )
-    return f"https://telegra.ph/{response['path']}"
-
-async def upload_to_telegram(file_data: BytesIO) -> str:
-    """上传文件到 Telegram 并返回文件 URL"""
-    url = f'https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendDocument'
-    files = {
-        'document': ('sticker.gif', file_data.getvalue(), 'image/gif')
-    }
-    data = {
-        'chat_id': CHAT_ID
-    }
-    
-    async with aiohttp.ClientSession() as session:
-        async with session.post(url, data=data, files=files) as response:
-            if response.status == 200:
-                result = await response.json()
-                if result.get('ok'):
-                    file_id = result['result']['document']['file_id']
-                    file_path_response = await session.get(f'https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/getFile', 
-                                                           params={'file_id': file_id})
-                    if file_path_response.status == 200:
-                        file_path = (await file_path_response.json())['result']['file_path']
-                        return f'https://api.telegram.org/file/bot{TELEGRAM_BOT_TOKEN}/{file_path}'
-    return None
-
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if not await restrict_access(update):
         return  # 立即停止处理此命令
     chat_id = update.effective_chat.id
-    # 初始化该用户的消息存储
-    message_store[chat_id] = []
+    # 正在 /end 时等待其完成，不清空正在读取的会话
+    async with chat_sequencer.command_lock(chat_id):
+        # 初始化该用户的消息存储，丢弃上一次未完成的后台任务
+        media_pipeline.cancel(chat_id)
+        album_aggregator.cancel(chat_id)
+        session_store.open(chat_id)
     # Reset the reminder flag when starting a new recording
     context.user_data['start_reminder_shown'] = False
     
     await update.message.reply_text('开始记录消息。请发送消息，完成后输入 /end 来结束。')
 
-async def end(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    chat_id = update.effective_chat.id
+# 转发远程图片到微信时可以重试的错误：新建素材不是幂等的，只在素材确定未创建时重试
+TRANSFER_RETRY_ON = (DownloadError, WechatTokenExpiredError, *CONNECT_ERRORS)
+
+async def transfer_url_to_wechat(wechat: AsyncWechat, url: str, temp_path: str, media_type: str = 'image'):
+    """
+    把远程文件转发到微信：下载响应体按块直接写入上传请求，不经过内存和临时文件
+    大小未知或超过 STREAM_SPILL_THRESHOLD 时先按块写入 temp_path 再上传
+    下载源的暂时性错误抛出 DownloadError
+    返回 ((media_id, 微信URL), 落盘的临时文件路径或 None)
+    """
+    try:
+        response = await http_client.session.get(url)
+    except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+        # 下载源的网络错误可以重试，但不计入微信的熔断
+        raise DownloadError(f"下载图片失败: {str(e)}") from e
+    async with response:
+        if response.status != 200:
+            error = DownloadError if response.status >= 500 else Exception
+            raise error(f"下载图片失败，状态码: {response.status}")
+        
+        filename = os.path.basename(url)
+        size = response.content_length
+        if size is not None and size <= STREAM_SPILL_THRESHOLD:
+            result = await wechat.upload_media_stream(
+                response.content.iter_chunked(STREAM_CHUNK_SIZE),
+                filename,
+                mediaType=media_type,
+                content_type=response.content_type
+            )
+            return result, None
+        
+        logger.info(f"文件大小 {size} 超过流式阈值，写入临时文件: {temp_path}")
+        async with aiofiles.open(temp_path, 'wb') as f:
+            async for chunk in response.content.iter_chunked(STREAM_CHUNK_SIZE):
+                await f.write(chunk)
+    
+    try:
+        return await wechat.upload_media(temp_path, mediaType=media_type), temp_path
+    except Exception:
+        os.unlink(temp_path)
+        raise
+
+async def prepare_wechat_image(wechat: AsyncWechat, msg: RecordedMessage, data: bytes = None,
+                               mime: str = None):
+    """
+    下载单张图片并上传到微信，失败时按配置重试
+    data 为已经在内存中的图片内容（MIME 类型为 mime，默认 JPEG），传入时直接上传，不再下载
+    返回 (微信图片URL, 本地文件路径, 是否为临时文件)
+    """
+    # 后台已经预上传的图片
+    if msg.wechat_url:
+        return msg.wechat_url, msg.local_path, msg.local_temp
+    
+    # 已经上传过微信的图片直接复用
+    cached = media_cache.get(msg.file_unique_id)
+    if cached and cached.get('wechat_url'):
+        return cached['wechat_url'], cached.get('path'), False
+    
+    logger.info(f"开始处理图片: {msg.content}")
+    local_path = msg.content
+    if cached and cached.get('path'):
+        # 使用缓存中的本地文件，无需重新下载
+        local_path = cached['path']
+        data = None
+    
+    if data is not None or not local_path.startswith('http'):
+        # 内存中的图片或本地文件，由发布引擎上传并重试
+        media = data if data is not None else local_path
+        mime = mime or mimetypes.guess_type(local_path)[0] or 'image/jpeg'
+        filename = f"photo_{msg.file_unique_id}{mimetypes.guess_extension(mime)}" if data is not None else None
+        result = await publisher.upload('wechat', media, mime, filename)
+        media_cache.put(msg.file_unique_id, wechat_media_id=result.media_id, wechat_url=result.url)
+        return result.url, None if data is not None else local_path, False
+    
+    async def transfer():
+        # 远程图片边下载边上传，过大时才落盘
+        temp_path = os.path.join(MEDIA_DIR, f"temp_{id(msg)}_{os.path.basename(local_path)}")
+        async with wechat_upload_semaphore:
+            return await transfer_url_to_wechat(wechat, local_path, temp_path)
+    
+    (wx_media_id, wx_url), spilled_path = await call_with_retry(
+        transfer,
+        retries=WECHAT_UPLOAD_RETRIES,
+        base_delay=UPLOAD_BACKOFF,
+        max_delay=UPLOAD_BACKOFF_MAX,
+        breaker=circuit_breakers.get(WechatBackend.host),
+        retry_on=TRANSFER_RETRY_ON,
+        description=f"处理图片 {local_path}"
+    )
+    media_cache.put(msg.file_unique_id, wechat_media_id=wx_media_id, wechat_url=wx_url)
+    return wx_url, spilled_path, spilled_path is not None
+
+async def preupload_wechat(message: RecordedMessage, message_id: int, entry: RecordedMessage = None,
+                           data: bytes = None, mime: str = None) -> None:
+    """
+    后台预上传图片到微信，/end 时直接使用结果
+    相册中的图片通过 entry 传入所属的相册记录，保存时更新整条相册记录
+    """
+    wechat = AsyncWechat(WECHAT_ACCESS_TOKEN, WECHAT_APPID, http_client.session, wechat_token_manager)
+    try:
+        wx_url, local_path, is_temp = await prepare_wechat_image(wechat, message, data, mime)
+    except Exception as e:
+        # 失败时由 /end 重新处理
+        logger.error(f"预上传图片到微信失败: {str(e)}")
+    else:
+        message.wechat_url = wx_url
+        message.local_path = local_path
+        message.local_temp = is_temp
     
-    if chat_id not in message_store:
-        await update.message.reply_text('请先使用 /start 命令开始记录。')
+    # 保存后台处理结果
+    session_store.update(message_id, entry or message)
+
+async def preprocess_photo(message: RecordedMessage, file, message_id: int, entry: RecordedMessage = None) -> None:
+    """
+    后台处理图片：下载后同时上传到 Telegraph 和微信
+    不超过 STREAM_SPILL_THRESHOLD 的图片只下载到内存，两个目标都直接上传内存中的内容；
+    更大的图片才落盘，并保存到缓存供 /end 使用
+    """
+    cached = media_cache.get(message.file_unique_id)
+    if cached and cached.get('telegraph_url'):
+        # 转发或重复的图片直接复用缓存的 Telegraph URL
+        logger.info(f"图片命中缓存: {message.file_unique_id}")
+        message.telegraph_url = cached['telegraph_url']
+        await preupload_wechat(message, message_id, entry)
         return
     
-    messages = message_store[chat_id]
-    message_count = len(messages)
+    local_path = None
+    if file.file_size and file.file_size > STREAM_SPILL_THRESHOLD:
+        # 文件名带上消息 ID，并发处理同一图片时不会互相覆盖
+        local_path = os.path.join(MEDIA_DIR, f"photo_{file.file_id}_{message_id}.jpg")
+        await file.download_to_drive(local_path)
+        media = local_path
+    else:
+        media = bytes(await file.download_as_bytearray())
+    
+    results = await publisher.publish(media, 'image/jpeg', ('telegraph', 'wechat'), filename='photo.jpg')
+    telegraph_result, wechat_result = results['telegraph'], results['wechat']
+    
+    if isinstance(telegraph_result, Exception):
+        logger.error(f"上传图片到Telegraph失败: {str(telegraph_result)}")
+    else:
+        message.telegraph_url = telegraph_result.url
+        media_cache.put(message.file_unique_id, telegraph_url=message.telegraph_url)
+    
+    if local_path:
+        if message.telegraph_url:
+            # 保存到缓存，大图片在 /end 时可直接使用本地文件
+            local_path = media_cache.store_file(message.file_unique_id, local_path)
+        else:
+            try:
+                os.unlink(local_path)
+            except Exception as e:
+                logger.error(f"删除临时文件失败: {str(e)}")
+            local_path = None
+    
+    if isinstance(wechat_result, Exception):
+        # 失败时由 /end 重新处理
+        logger.error(f"预上传图片到微信失败: {str(wechat_result)}")
+    else:
+        message.wechat_url = wechat_result.url
+        message.local_path = local_path
+        media_cache.put(message.file_unique_id, wechat_media_id=wechat_result.media_id, wechat_url=wechat_result.url)
+    
+    # 保存后台处理结果
+    session_store.update(message_id, entry or message)
+
+async def end(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    chat_id = update.effective_chat.id
     
-    # 为微信创建消息的深拷贝，这样不会影响 Telegraph 的 URL
-    wechat_messages = []
-    telegraph_messages = []
-    for msg in messages:
-        # 为微信创建一个副本
-        wechat_msg = msg.copy()
-        wechat_messages.append(wechat_msg)
+    # 同一会话的 /start、/end 串行执行，重复的 /end 在前一个完成后发现会话已关闭
+    async with chat_sequencer.command_lock(chat_id):
+        if not session_store.is_open(chat_id):
+            await update.message.reply_text('请先使用 /start 命令开始记录。')
+            return
         
-        # 为Telegraph创建一个副本
-        telegraph_msg = msg.copy()
-        if telegraph_msg['type'] == 'photo' and 'telegraph_url' in telegraph_msg:
-            telegraph_msg['content'] = telegraph_msg['telegraph_url']
-        telegraph_messages.append(telegraph_msg)
+        # 在第一次 await 之前标记正在结束，之后到达的消息不再写入本次记录
+        with chat_sequencer.closing(chat_id):
+            await finish_recording(update, chat_id)
+
+async def finish_recording(update: Update, chat_id: int) -> None:
+    """发布本次记录：同步到 Telegraph 和微信草稿箱，成功或同步微信失败后关闭会话"""
+    # 等待正在处理的消息写入，结束正在收集的相册，然后等待后台预处理完成
+    await chat_sequencer.wait(chat_id)
+    album_aggregator.flush(chat_id)
+    await media_pipeline.drain(chat_id)
+    
+    messages = session_store.load(chat_id)
+    message_count = len(messages)
     
     # 初始化微信
-    wechat = Wechat(WECHAT_ACCESS_TOKEN, WECHAT_APPID)
+    wechat = AsyncWechat(WECHAT_ACCESS_TOKEN, WECHAT_APPID, http_client.session, wechat_token_manager)
+    
+    # 先处理所有图片，并发上传到微信，结果按原顺序回填
+    photo_messages = [photo for msg in messages for photo in msg.photos]
+    results = await asyncio.gather(
+        *(prepare_wechat_image(wechat, msg) for msg in photo_messages),
+        return_exceptions=True
+    )
     
-    # 先处理所有图片，上传到微信
     first_image_path = None
-    for idx, msg in enumerate(wechat_messages):
-        if msg['type'] == 'photo':
-            try:
-                logger.info(f"开始处理图片: {msg['content']}")
-                
-                # 检查是否是URL
-                if msg['content'].startswith('http'):
-                    # 下载图片到临时文件
-                    temp_path = os.path.join(MEDIA_DIR, f"temp_{os.path.basename(msg['content'])}")
-                    async with aiohttp.ClientSession() as session:
-                        async with session.get(msg['content']) as response:
-                            if response.status == 200:
-                                with open(temp_path, 'wb') as f:
-                                    f.write(await response.read())
-                                msg['content'] = temp_path
-                            else:
-                                raise Exception(f"下载图片失败，状态码: {response.status}")
-                
-                # 如果是第一张图片，保存其路径作为封面
-                if first_image_path is None:
-                    first_image_path = msg['content']
-                    logger.info(f"设置第一张图片作为封面: {first_image_path}")
-                
-                # 上传到微信
-                wx_url = wechat.upload_image_to_wechat(msg['content'])[1]
-                msg['content'] = wx_url
-                
-                # 如果是临时文件，删除它
-                if 'temp_' in msg['content']:
-                    try:
-                        os.unlink(msg['content'])
-                    except Exception as e:
-                        logger.error(f"删除临时文件失败: {str(e)}")
-                
-            except Exception as e:
-                logger.exception(f"处理图片时出错: {str(e)}")
-                msg['type'] = 'text'
-                msg['content'] = '[图片处理失败]'
+    first_image_url = None
+    # 封面是否为本次下载的临时文件
+    cover_temp = False
+    temp_files = []
+    for msg, result in zip(photo_messages, results):
+        if isinstance(result, Exception):
+            logger.error(f"处理图片时出错: {str(result)}")
+            msg.wechat_failed = True
+            continue
+        
+        wx_url, local_path, is_temp = result
+        source = msg.content
+        msg.wechat_url = wx_url
+        # 第一张图片作为封面，流式上传的图片没有本地文件，记录其原始 URL；
+        # 会话中保存的缓存文件可能已被淘汰，文件不存在时同样改用 URL
+        if first_image_path is None and first_image_url is None:
+            if local_path and os.path.exists(local_path):
+                first_image_path = local_path
+                cover_temp = is_temp
+            elif source.startswith('http'):
+                first_image_url = source
+            logger.info(f"设置第一张图片作为封面: {first_image_path or first_image_url}")
+        elif is_temp:
+            temp_files.append(local_path)
+    
+    # 删除封面以外的临时文件
+    for path in temp_files:
+        try:
+            os.unlink(path)
+        except Exception as e:
+            logger.error(f"删除临时文件失败: {str(e)}")
     
     # 如果没有成功处理任何图片，使用一个默认图片作为封面
-    if not first_image_path:
+    default_image_path = os.path.join(os.path.dirname(__file__), 'assets', 'default_cover.jpg')
+    if not first_image_path and not first_image_url:
         logger.info("没有可用的图片作为封面，使用默认图片")
-        default_image_path = os.path.join(os.path.dirname(__file__), 'assets', 'default_cover.jpg')
         if os.path.exists(default_image_path):
             first_image_path = default_image_path
         else:
-            raise ValueError("需要至少一张图片作为封面，且默认封面图片不存在")
+            # 在发布 Telegraph 之前检查，避免每次 /end 都留下无人引用的页面
+            logger.error("需要至少一张图片作为封面，且默认封面图片不存在")
+            await update.message.reply_text('没有可用作微信封面的图片，且未配置默认封面。\n记录已保留，请发送一张图片后再次 /end。')
+            return
     
-    # 初始化模板管理器
-    template_manager = TemplateManager()
-    
-    # 生成 Telegraph HTML（使用带有Telegraph URL的消息）
-    telegraph_html = template_manager.render_telegraph_template(telegraph_messages)
+    # 上传到 Telegraph（使用带有Telegraph URL的消息），内容过长时自动分页
+    try:
+        telegraph_url = await telegraph_publisher.publish(messages)
+    except Exception as e:
+        # 保留会话，用户可以再次 /end 重试；本次下载的封面临时文件不会再被使用
+        logger.exception(f"发布到 Telegraph 失败: {str(e)}")
+        if cover_temp:
+            os.unlink(first_image_path)
+        await update.message.reply_text(f'发布到 Telegraph 时出错: {str(e)}\n记录已保留，可以稍后再次 /end 重试。')
+        return
     
-    # 上传到 Telegraph
-    telegraph_url = await upload_to_telegraph(telegraph_html)
+    logger.info(f"媒体上传统计: {publisher.metrics()}, 熔断状态: {circuit_breakers.states()}")
     
     try:
+        # 微信接口统一退避重试，公众号接口熔断时直接失败；新建素材和草稿不是幂等的，只在连接未建立时重试
+        wechat_retry = functools.partial(
+            call_with_retry,
+            retries=WECHAT_UPLOAD_RETRIES,
+            base_delay=UPLOAD_BACKOFF,
+            max_delay=UPLOAD_BACKOFF_MAX,
+            breaker=circuit_breakers.get(WechatBackend.host)
+        )
+        
         # 如果有图片，上传第一张作为缩略图
         if first_image_path:
-            thumb_media_id = wechat.upload_media(first_image_path, mediaType='thumb')
+            thumb_media_id = await wechat_retry(
+                lambda: wechat.upload_media(first_image_path, mediaType='thumb'),
+                retry_on=CONNECT_ERRORS,
+                description='上传缩略图'
+            )
+        elif first_image_url:
+            thumb_temp_path = os.path.join(MEDIA_DIR, f"temp_thumb_{os.path.basename(first_image_url)}")
+            thumb_media_id, first_image_path = await wechat_retry(
+                lambda: transfer_url_to_wechat(wechat, first_image_url, thumb_temp_path, media_type='thumb'),
+                retry_on=TRANSFER_RETRY_ON,
+                description='上传缩略图'
+            )
         else:
             # 如果没有图片，抛出异常
             raise ValueError("需要至少一张图片作为封面")
         
-        # 使用模板生成微信文章 HTML（使用微信的图片URL）
-        wechat_html = template_manager.render_wechat_template(wechat_messages)
-        
-        # 保存HTML到临时文件
+        # 使用模板生成微信文章 HTML（使用微信的图片URL），直接流式写入临时文件
         with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.html', encoding='utf-8') as tmp_file:
-            tmp_file.write(wechat_html)
+            await asyncio.to_thread(template_manager.render_wechat_to_file, messages, tmp_file)
             html_path = tmp_file.name
         
-        # 发送到微信草稿箱
-        result = wechat.send_draft(html_path, thumb_media_id)
+        # 发送到微信草稿箱，只在连接未建立时重试，避免重复创建草稿
+        result = await wechat_retry(
+            lambda: wechat.send_draft(html_path, thumb_media_id),
+            retry_on=CONNECT_ERRORS,
+            description='发送草稿'
+        )
         
         # 清理临时文件
         os.unlink(html_path)
-        if first_image_path:
+        if first_image_path and first_image_path != default_image_path and not media_cache.owns(first_image_path):
             os.unlink(first_image_path)
         
         await update.message.reply_text(
@@ -236,7 +483,7 @@ async def end(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     except Exception as e:
         await update.message.reply_text(f'同步到微信时出错: {str(e)}')
     
-    del message_store[chat_id]
+    session_store.close(chat_id)
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if not await restrict_access(update):
@@ -244,22 +491,49 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
     chat_id = update.effective_chat.id
     
-    if chat_id not in message_store:
+    if chat_sequencer.is_closing(chat_id):
+        await update.message.reply_text('正在结束本次记录，这条消息不会被记录。请在完成后使用 /start 开始新的记录。')
+        return
+    
+    if not session_store.is_open(chat_id):
         # Check if we've already shown the reminder
         if not context.user_data.get('start_reminder_shown'):
             await update.message.reply_text('请先使用 /start 命令开始记录。')
             context.user_data['start_reminder_shown'] = True
         return
     
-    message = {
-        'time': update.message.date.strftime("%Y-%m-%d %H:%M:%S"),
-        'type': 'text'
-    }
+    # 到达时按 Telegram message_id 预留位置，处理完成后写入，并发处理时保持原始顺序
+    slot = chat_sequencer.reserve(chat_id, update.message.message_id)
+    try:
+        await record_message(update, context, chat_id, slot)
+    finally:
+        chat_sequencer.release(slot)
+
+async def record_message(update: Update, context: ContextTypes.DEFAULT_TYPE, chat_id: int, slot: Slot) -> None:
+    """处理一条消息并写入预留的位置"""
+    # 需要在后台继续处理的任务，消息入库后再提交
+    background_job = None
+    # 已在内存中转换好的静态贴纸，直接用于上传微信
+    sticker_data = None
+    sticker_mime = None
+    
+    message = RecordedMessage(time=update.message.date.strftime("%Y-%m-%d %H:%M:%S"))
+    
+    # 查询贴纸缓存，重复的贴纸无需重新下载、转码和上传
+    sticker_cache = None
+    if update.message.sticker:
+        sticker_cache = media_cache.get(update.message.sticker.file_unique_id)
     
     # 处理不同类型的消息
     if update.message.text:
-        message['type'] = 'text'
-        message['content'] = update.message.text
+        message.type = 'text'
+        message.content = update.message.text
+    elif sticker_cache and sticker_cache.get('telegraph_url'):
+        logger.info(f"贴纸命中缓存: {update.message.sticker.file_unique_id}")
+        message.type = 'photo'
+        message.telegraph_url = sticker_cache['telegraph_url']
+        message.content = sticker_cache['telegraph_url']
+        message.file_unique_id = update.message.sticker.file_unique_id
     elif update.message.sticker:
         file = await context.bot.get_file(update.message.sticker.file_id)
         logger.info(f"处理贴纸: animated={update.message.sticker.is_animated}, video={update.message.sticker.is_video}")
@@ -267,7 +541,9 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         if update.message.sticker.is_animated or update.message.sticker.is_video:
             try:
                 # 下载动态贴纸
-                sticker_path = os.path.join(MEDIA_DIR, f"sticker_{file.file_id}")
+                # 临时文件名带上消息 ID，并发处理同一贴纸时下载和转码结果不会互相覆盖
+                sticker_name = f"sticker_{file.file_id}_{update.message.message_id}"
+                sticker_path = os.path.join(MEDIA_DIR, sticker_name)
                 if update.message.sticker.is_animated:
                     sticker_path += '.tgs'
                     logger.info(f"下载动态贴纸到: {sticker_path}")
@@ -276,193 +552,46 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                     logger.info(f"下载视频贴纸到: {sticker_path}")
                 await file.download_to_drive(sticker_path)
                 
-                # 处理动态贴纸
-                if update.message.sticker.is_animated:
-                    # 解析 TGS 文件
-                    logger.info("开始解析 TGS 文件")
-                    animation = parsers.tgs.parse_tgs(sticker_path)
-                    # 导出为 GIF
-                    gif_path = os.path.join(MEDIA_DIR, f"sticker_{file.file_id}.gif")
-                    logger.info(f"导出 GIF 到: {gif_path}")
-                    exporters.gif.export_gif(animation, gif_path)
-                    logger.info("GIF 导出完成")
-                    
-                    message['type'] = 'photo'
-                    message['content'] = gif_path  # 为微信使用本地 GIF 路径
-                    
-                    # 如果是第一个贴纸，还需要生成 PNG 作为封面
-                    if len(message_store[chat_id]) == 0:
-                        png_path = os.path.join(MEDIA_DIR, f"sticker_{file.file_id}.png")
-                        exporters.png.export_png(animation, png_path)
-                        message['is_first'] = True
-                        message['cover_path'] = png_path
-                    
-                    # 为 Telegraph 上传 GIF 并获取 URL
-                    try:
-                        logger.info(f"开始上传GIF到Telegram: {gif_path}")
-                        # 读取GIF文件到内存
-                        with open(gif_path, 'rb') as f:
-                            gif_data = BytesIO(f.read())
-                        
-                        # 上传到Telegram获取URL
-                        url = f'https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendDocument'
-                        files = {
-                            'document': ('sticker.gif', gif_data.getvalue(), 'image/gif')
-                        }
-                        data = {
-                            'chat_id': CHAT_ID
-                        }
-                        
-                        # 使用 requests 上传到 Telegram
-                        response = await asyncio.to_thread(
-                            requests.post,
-                            url,
-                            files=files,
-                            data=data
-                        )
-                        
-                        logger.info(f"Telegram 上传状态: {response.status_code}")
-                        if response.status_code == 200:
-                            result = response.json()
-                            if result.get('ok'):
-                                file_id = result['result']['document']['file_id']
-                                file_path_response = await asyncio.to_thread(
-                                    requests.get,
-                                    f'https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/getFile',
-                                    params={'file_id': file_id}
-                                )
-                                if file_path_response.status_code == 200:
-                                    file_path = file_path_response.json()['result']['file_path']
-                                    telegram_url = f'https://api.telegram.org/file/bot{TELEGRAM_BOT_TOKEN}/{file_path}'
-                                    
-                                    # 创建Telegraph页面
-                                    content = [
-                                        {
-                                            'tag': 'p',
-                                            'children': [
-                                                {
-                                                    'tag': 'img',
-                                                    'attrs': {'src': telegram_url}
-                                                }
-                                            ]
-                                        }
-                                    ]
-                                    response = await asyncio.to_thread(
-                                        telegraph.create_page,
-                                        title='Sticker Test',
-                                        author_name='Bot',
-                                        content=content
-                                    )
-                                    if 'path' in response:
-                                        message['telegraph_url'] = f"https://telegra.ph/{response['path']}"
-                                        logger.info(f"Telegraph 页面 URL: {message['telegraph_url']}")
-                                    else:
-                                        logger.error(f"创建Telegraph页面失败: {response}")
-                                else:
-                                    logger.error("获取Telegram文件路径失败")
-                            else:
-                                logger.error(f"上传到Telegram失败: {result}")
-                        else:
-                            logger.error(f"上传到Telegram失败，状态码: {response.status_code}")
-                    except Exception as e:
-                        logger.error(f"处理动态贴纸上传失败: {str(e)}")
-                    
-                    # 如果是优化后的GIF，清理它
-                    if 'optimized_' in gif_path:
-                        try:
-                            os.unlink(gif_path)
-                        except Exception as e:
-                            logger.error(f"删除优化后的GIF失败: {str(e)}")
-                    
-                elif update.message.sticker.is_video:
-                    # 处理视频贴纸为 GIF
-                    gif_path = os.path.join(MEDIA_DIR, f"sticker_{file.file_id}.gif")
-                    reader = imageio.get_reader(sticker_path)
-                    fps = reader.get_meta_data()['fps']
-                    frames = []
-                    for frame in reader:
-                        frames.append(frame)
-                    reader.close()
-                    
-                    # 写入 GIF，限制帧率以控制文件大小
-                    target_fps = min(fps, 15)  # 限制最大帧率
-                    imageio.mimsave(gif_path, frames, fps=target_fps)
-                    logger.info(f"GIF 已保存到: {gif_path}")
-                    
-                    message['type'] = 'photo'
-                    message['content'] = gif_path  # 为微信使用本地 GIF 路径
-                    
-                    # 如果是第一个贴纸，使用第一帧作为封面
-                    if len(message_store[chat_id]) == 0:
-                        png_path = os.path.join(MEDIA_DIR, f"sticker_{file.file_id}.png")
-                        imageio.imwrite(png_path, frames[0])
-                        message['is_first'] = True
-                        message['cover_path'] = png_path
-                    
-                # 为 Telegraph 上传 GIF 并获取 URL
-                try:
-                    logger.info(f"开始上传GIF到Telegraph: {gif_path}")
-                    # 检查文件大小
-                    file_size = os.path.getsize(gif_path)
-                    logger.info(f"GIF文件大小: {file_size / 1024:.2f} KB")
-                    
-                    # 总是优化GIF以确保上传成功
-                    logger.info("优化GIF以确保上传成功")
-                    optimized_gif_path = os.path.join(MEDIA_DIR, f"optimized_{os.path.basename(gif_path)}")
-                    reader = imageio.get_reader(gif_path)
-                    frames = []
-                    for frame in reader:
-                        # 使用PIL调整大小
-                        frame_image = Image.fromarray(frame)
-                        width, height = frame_image.size
-                        new_width = min(width, 320)
-                        new_height = int(height * (new_width / width))
-                        frame_image = frame_image.resize((new_width, new_height), Image.Resampling.LANCZOS)
-                        frames.append(numpy.array(frame_image))
-                    reader.close()
-                    
-                    # 使用更低的帧率
-                    imageio.mimsave(optimized_gif_path, frames, fps=10, optimize=True)
-                    gif_path = optimized_gif_path
-                    logger.info(f"优化后的GIF大小: {os.path.getsize(gif_path) / 1024:.2f} KB")
-                    
-                    # 尝试多次上传到Telegraph
-                    max_retries = 3
-                    for attempt in range(max_retries):
-                        try:
-                            async with aiohttp.ClientSession() as session:
-                                form = aiohttp.FormData()
-                                form.add_field('file', open(gif_path, 'rb'), filename='sticker.gif', content_type='image/gif')
-                                async with session.post('https://telegra.ph/upload', data=form) as response:
-                                    logger.info(f"Telegraph上传响应状态码: {response.status}")
-                                    if response.status == 200:
-                                        result = await response.json()
-                                        logger.info(f"Telegraph上传响应: {result}")
-                                        if result and isinstance(result, list) and len(result) > 0:
-                                            telegraph_path = result[0].get('src')
-                                            if telegraph_path:
-                                                message['telegraph_url'] = f'https://telegra.ph{telegraph_path}'
-                                                message['content'] = message['telegraph_url']  # 使用Telegraph URL作为内容
-                                                logger.info(f"Telegraph 图片 URL: {message['telegraph_url']}")
-                                                break
-                                    else:
-                                        response_text = await response.text()
-                                        logger.error(f"Telegraph上传失败，状态码: {response.status}, 响应: {response_text}")
-                        except Exception as e:
-                            logger.error(f"第{attempt + 1}次上传失败: {str(e)}")
-                            if attempt == max_retries - 1:
-                                raise
-                            await asyncio.sleep(1)  # 等待1秒后重试
-                    
-                    # 如果是优化后的GIF，清理它
-                    if 'optimized_' in gif_path:
-                        try:
-                            os.unlink(gif_path)
-                        except Exception as e:
-                            logger.error(f"删除优化后的GIF失败: {str(e)}")
-                            
-                except Exception as e:
-                    logger.exception(f"上传GIF到Telegraph时发生错误: {str(e)}")
+                # 直接按目标尺寸和帧率转码为 GIF，如果是第一个贴纸，同时生成 PNG 作为封面
+                gif_path = os.path.join(MEDIA_DIR, f"{sticker_name}.gif")
+                png_path = None
+                if slot.index == 0:
+                    png_path = os.path.join(MEDIA_DIR, f"{sticker_name}.png")
+                kind = 'tgs' if update.message.sticker.is_animated else 'webm'
+                logger.info(f"导出 GIF 到: {gif_path}")
+                await sticker_converter.transcode(
+                    sticker_path, kind, gif_path, png_path,
+                    max_width=STICKER_MAX_WIDTH, fps=STICKER_FPS,
+                    set_name=update.message.sticker.set_name,
+                    file_unique_id=update.message.sticker.file_unique_id
+                )
+                logger.info(f"GIF 导出完成，大小: {os.path.getsize(gif_path) / 1024:.2f} KB")
+                
+                message.type = 'photo'
+                message.content = gif_path  # 为微信使用本地 GIF 路径
+                
+                if png_path:
+                    message.is_first = True
+                    message.cover_path = png_path
+                
+                # 上传到 Telegraph，TGS 贴纸同时上传到 Telegram，Telegraph 失败时使用 Telegram 文件链接
+                destinations = ('telegraph', 'telegram') if update.message.sticker.is_animated else ('telegraph',)
+                logger.info(f"开始上传GIF: {gif_path} -> {destinations}")
+                results = await publisher.publish(gif_path, 'image/gif', destinations, filename='sticker.gif')
+                telegraph_result = results['telegraph']
+                telegram_result = results.get('telegram')
+                if not isinstance(telegraph_result, Exception):
+                    message.telegraph_url = telegraph_result.url
+                    message.content = message.telegraph_url  # 使用Telegraph URL作为内容
+                    # 保存到缓存，后续相同贴纸直接复用
+                    sticker_uid = update.message.sticker.file_unique_id
+                    gif_path = media_cache.store_file(sticker_uid, gif_path)
+                    media_cache.put(sticker_uid, telegraph_url=message.telegraph_url)
+                    message.file_unique_id = sticker_uid
+                else:
+                    logger.error(f"上传GIF到Telegraph失败: {str(telegraph_result)}")
+                    if telegram_result is not None and not isinstance(telegram_result, Exception):
+                        message.telegraph_url = telegram_result.url
                     
                 # 在上传完成后，确认message中是否有telegraph_url
                 logger.info(f"最终的message内容: {message}")
@@ -472,131 +601,97 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                 
             except Exception as e:
                 logger.exception(f"处理动态贴纸失败: {str(e)}")
-                message['type'] = 'text'
-                message['content'] = '[贴纸处理失败]'
+                message.type = 'text'
+                message.content = '[贴纸处理失败]'
         else:
             try:
-                # 静态贴纸处理
-                sticker_path = os.path.join(MEDIA_DIR, f"sticker_{file.file_id}.webp")
-                await file.download_to_drive(sticker_path)
-                
-                # 转换为 PNG
-                with Image.open(sticker_path) as img:
-                    # 强制转换为 RGB
-                    if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
-                        bg = Image.new('RGB', img.size, (255, 255, 255))
-                        if img.mode == 'P':
-                            img = img.convert('RGBA')
-                        bg.paste(img, mask=img.split()[3] if len(img.split()) > 3 else None)
-                        img = bg
-                    
-                    # 保存为 PNG
-                    png_path = os.path.join(MEDIA_DIR, f"sticker_{file.file_id}.png")
-                    img.save(png_path, 'PNG')
-                    
-                    # 删除原始 webp 文件
-                    os.unlink(sticker_path)
-                    sticker_path = png_path
+                # 静态贴纸处理：下载到内存，在线程池中转换为 PNG 或 JPEG
+                webp_data = bytes(await file.download_as_bytearray())
+                sticker_data, sticker_mime = await sticker_converter.convert_static(webp_data)
+                sticker_ext = mimetypes.guess_extension(sticker_mime)
 
                 # 为 Telegraph 保存原始 URL
-                message['type'] = 'photo'
+                message.type = 'photo'
                 
                 # 上传到Telegraph
                 try:
-                    async with aiohttp.ClientSession() as session:
-                        form = aiohttp.FormData()
-                        form.add_field('file', open(sticker_path, 'rb'), filename='sticker.png', content_type='image/png')
-                        async with session.post('https://telegra.ph/upload', data=form) as response:
-                            logger.info(f"Telegraph上传响应状态码: {response.status}")
-                            if response.status == 200:
-                                result = await response.json()
-                                logger.info(f"Telegraph上传响应: {result}")
-                                if result and isinstance(result, list) and len(result) > 0:
-                                    telegraph_path = result[0].get('src')
-                                    if telegraph_path:
-                                        message['telegraph_url'] = f'https://telegra.ph{telegraph_path}'
-                                        message['content'] = message['telegraph_url']  # 使用Telegraph URL作为内容
-                                        logger.info(f"Telegraph 图片 URL: {message['telegraph_url']}")
+                    result = await publisher.upload('telegraph', sticker_data, sticker_mime, filename=f'sticker{sticker_ext}')
+                    message.telegraph_url = result.url
+                    message.content = message.telegraph_url  # 使用Telegraph URL作为内容
+                    # 保存到缓存，后续相同贴纸直接复用
+                    sticker_uid = update.message.sticker.file_unique_id
+                    media_cache.put(sticker_uid, telegraph_url=message.telegraph_url)
+                    message.file_unique_id = sticker_uid
                 except Exception as e:
-                    logger.error(f"上传PNG到Telegraph失败: {str(e)}")
+                    logger.error(f"上传贴纸到Telegraph失败: {str(e)}")
                     # 如果上传失败，使用Telegram URL作为备用
                     if file.file_path.startswith('http'):
-                        message['content'] = file.file_path
+                        message.content = file.file_path
                     else:
-                        message['content'] = f"https://api.telegram.org/file/bot{TELEGRAM_BOT_TOKEN}/{file.file_path}"
+                        message.content = f"https://api.telegram.org/file/bot{TELEGRAM_BOT_TOKEN}/{file.file_path}"
             except Exception as e:
                 logger.error(f"处理静态贴纸失败: {str(e)}")
-                message['type'] = 'text'
-                message['content'] = f"[贴纸处理失败 {update.message.sticker.emoji if update.message.sticker.emoji else ''}]"
+                message.type = 'text'
+                message.content = f"[贴纸处理失败 {update.message.sticker.emoji if update.message.sticker.emoji else ''}]"
     elif update.message.photo:
-        message['type'] = 'photo'
+        message.type = 'photo'
         photo = update.message.photo[-1]  # Get the highest quality photo
         file = await context.bot.get_file(photo.file_id)
+        message.file_unique_id = photo.file_unique_id
         
-        # Download the photo to local storage first
-        local_path = os.path.join(MEDIA_DIR, f"photo_{file.file_id}.jpg")
-        await file.download_to_drive(local_path)
-        
-        # Upload to Telegraph
-        try:
-            async with aiohttp.ClientSession() as session:
-                form = aiohttp.FormData()
-                form.add_field('file', open(local_path, 'rb'), filename='photo.jpg', content_type='image/jpeg')
-                async with session.post('https://telegra.ph/upload', data=form) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        if result and isinstance(result, list) and len(result) > 0:
-                            telegraph_path = result[0].get('src')
-                            if telegraph_path:
-                                message['telegraph_url'] = f'https://telegra.ph{telegraph_path}'
-                                logger.info(f"Telegraph 图片 URL: {message['telegraph_url']}")
-        except Exception as e:
-            logger.error(f"上传图片到Telegraph失败: {str(e)}")
-            
         # Set content as the original Telegram URL for WeChat
         if file.file_path.startswith('http'):
-            message['content'] = file.file_path
+            message.content = file.file_path
         else:
-            message['content'] = f"https://api.telegram.org/file/bot{TELEGRAM_BOT_TOKEN}/{file.file_path}"
+            message.content = f"https://api.telegram.org/file/bot{TELEGRAM_BOT_TOKEN}/{file.file_path}"
             
         if update.message.caption:
-            message['caption'] = update.message.caption
-            
-        # Clean up local file
-        try:
-            os.unlink(local_path)
-        except Exception as e:
-            logger.error(f"删除临时文件失败: {str(e)}")
+            message.caption = update.message.caption
+        
+        # 下载和上传在后台进行，不阻塞后续消息
+        background_job = functools.partial(preprocess_photo, message, file)
     elif update.message.document:
-        message['type'] = 'document'
+        message.type = 'document'
         file = await context.bot.get_file(update.message.document.file_id)
         if file.file_path.startswith('http'):
-            message['content'] = file.file_path
+            message.content = file.file_path
         else:
-            message['content'] = f"https://api.telegram.org/file/bot{TELEGRAM_BOT_TOKEN}/{file.file_path}"
-        message['filename'] = update.message.document.file_name
+            message.content = f"https://api.telegram.org/file/bot{TELEGRAM_BOT_TOKEN}/{file.file_path}"
+        message.filename = update.message.document.file_name
     elif update.message.video:
-        message['type'] = 'video'
+        message.type = 'video'
         file = await context.bot.get_file(update.message.video.file_id)
         if file.file_path.startswith('http'):
-            message['content'] = file.file_path
+            message.content = file.file_path
         else:
-            message['content'] = f"https://api.telegram.org/file/bot{TELEGRAM_BOT_TOKEN}/{file.file_path}"
+            message.content = f"https://api.telegram.org/file/bot{TELEGRAM_BOT_TOKEN}/{file.file_path}"
     elif update.message.voice:
-        message['type'] = 'voice'
+        message.type = 'voice'
         file = await context.bot.get_file(update.message.voice.file_id)
         if file.file_path.startswith('http'):
-            message['content'] = file.file_path
+            message.content = file.file_path
         else:
-            message['content'] = f"https://api.telegram.org/file/bot{TELEGRAM_BOT_TOKEN}/{file.file_path}"
+            message.content = f"https://api.telegram.org/file/bot{TELEGRAM_BOT_TOKEN}/{file.file_path}"
     
     # 处理转发消息
     if hasattr(update.message, 'forward_from') and update.message.forward_from:
-        message['forward_from'] = update.message.forward_from.full_name
-        message['forward_date'] = update.message.forward_date.strftime("%Y-%m-%d %H:%M:%S")
+        message.forward_from = update.message.forward_from.full_name
+        message.forward_date = update.message.forward_date.strftime("%Y-%m-%d %H:%M:%S")
+    
+    # 贴纸转换完成后在后台预上传到微信
+    if update.message.sticker and message.type == 'photo':
+        background_job = functools.partial(preupload_wechat, message, data=sticker_data, mime=sticker_mime)
     
-    logger.info(f"添加消息到存储: type={message['type']}, content={message.get('content', '')}")
-    message_store[chat_id].append(message)
+    # 相册中的图片先聚合，整组作为一条记录
+    if update.message.photo and update.message.media_group_id:
+        logger.info(f"添加图片到相册 {update.message.media_group_id}: {message.content}")
+        album_aggregator.add(chat_id, update.message.media_group_id, message, slot, background_job)
+        return
+    
+    logger.info(f"添加消息到存储: type={message.type}, content={message.content}")
+    message_id = chat_sequencer.fill(slot, message)
+    if background_job:
+        media_pipeline.submit(chat_id, functools.partial(background_job, message_id=message_id))
 
 async def start_telegraph(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """测试 Telegraph 上传功能的命令"""
@@ -622,7 +717,8 @@ async def test_telegraph_upload(update: Update, context: ContextTypes.DEFAULT_TY
         
     try:
         file = await context.bot.get_file(update.message.sticker.file_id)
-        sticker_path = os.path.join(MEDIA_DIR, f"sticker_{file.file_id}")
+        sticker_name = f"sticker_{file.file_id}_{update.message.message_id}"
+        sticker_path = os.path.join(MEDIA_DIR, sticker_name)
         
         # 下载贴纸
         if update.message.sticker.is_animated:
@@ -634,87 +730,46 @@ async def test_telegraph_upload(update: Update, context: ContextTypes.DEFAULT_TY
         await file.download_to_drive(sticker_path)
         
         # 转换为 GIF
-        gif_path = os.path.join(MEDIA_DIR, f"sticker_{file.file_id}.gif")
-        if update.message.sticker.is_animated:
-            animation = parsers.tgs.parse_tgs(sticker_path)
-            exporters.gif.export_gif(animation, gif_path)
-        elif update.message.sticker.is_video:
-            reader = imageio.get_reader(sticker_path)
-            fps = reader.get_meta_data()['fps']
-            frames = []
-            for frame in reader:
-                frames.append(frame)
-            reader.close()
-            imageio.mimsave(gif_path, frames, fps=min(fps, 15))
-            
-        # 读取 GIF 到内存
-        with open(gif_path, 'rb') as f:
-            gif_data = BytesIO(f.read())
+        gif_path = os.path.join(MEDIA_DIR, f"{sticker_name}.gif")
+        kind = 'tgs' if update.message.sticker.is_animated else 'webm'
+        await sticker_converter.transcode(sticker_path, kind, gif_path, max_width=STICKER_MAX_WIDTH, fps=STICKER_FPS)
             
         # 上传到 Telegram
-        url = f'https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendDocument'
-        files = {
-            'document': ('sticker.gif', gif_data.getvalue(), 'image/gif')
-        }
-        data = {
-            'chat_id': CHAT_ID
-        }
-        
-        # 使用 requests 上传到 Telegram
-        response = await asyncio.to_thread(
-            requests.post,
-            url,
-            files=files,
-            data=data
-        )
-        
-        logger.info(f"Telegram 上传状态: {response.status_code}")
-        if response.status_code == 200:
-            result = response.json()
-            if result.get('ok'):
-                file_id = result['result']['document']['file_id']
-                file_path_response = await asyncio.to_thread(
-                    requests.get,
-                    f'https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/getFile',
-                    params={'file_id': file_id}
-                )
-                if file_path_response.status_code == 200:
-                    file_path = file_path_response.json()['result']['file_path']
-                    telegram_url = f'https://api.telegram.org/file/bot{TELEGRAM_BOT_TOKEN}/{file_path}'
-                    
-                    # 创建 Telegraph 页面
-                    content = [
+        try:
+            telegram_url = (await publisher.upload('telegram', gif_path, 'image/gif', filename='sticker.gif')).url
+        except Exception as e:
+            logger.error(f"上传到 Telegram 失败: {str(e)}")
+            telegram_url = None
+        if telegram_url:
+            # 创建 Telegraph 页面
+            content = [
+                {
+                    'tag': 'p',
+                    'children': [
                         {
-                            'tag': 'p',
-                            'children': [
-                                {
-                                    'tag': 'img',
-                                    'attrs': {'src': telegram_url}
-                                }
-                            ]
+                            'tag': 'img',
+                            'attrs': {'src': telegram_url}
                         }
                     ]
-                    response = await asyncio.to_thread(
-                        telegraph.create_page,
-                        title='Sticker Test',
-                        author_name='Bot',
-                        content=content
-                    )
-                    if 'path' in response:
-                        telegraph_url = f"https://telegra.ph/{response['path']}"
-                        await update.message.reply_text(
-                            f'测试成功！\n'
-                            f'Telegram URL: {telegram_url}\n'
-                            f'Telegraph URL: {telegraph_url}'
-                        )
-                    else:
-                        await update.message.reply_text(f'创建 Telegraph 页面失败: {response}')
-                else:
-                    await update.message.reply_text('获取 Telegram 文件路径失败')
+                }
+            ]
+            response = await asyncio.to_thread(
+                telegraph.create_page,
+                title='Sticker Test',
+                author_name='Bot',
+                content=content
+            )
+            if 'path' in response:
+                telegraph_url = f"https://telegra.ph/{response['path']}"
+                await update.message.reply_text(
+                    f'测试成功！\n'
+                    f'Telegram URL: {telegram_url}\n'
+                    f'Telegraph URL: {telegraph_url}'
+                )
             else:
-                await update.message.reply_text(f'上传到 Telegram 失败: {result}')
+                await update.message.reply_text(f'创建 Telegraph 页面失败: {response}')
         else:
-            await update.message.reply_text(f'上传到 Telegram 失败，状态码: {response.status_code}')
+            await update.message.reply_text('上传到 Telegram 失败')
                     
         # 清理文件
         os.unlink(sticker_path)
@@ -724,8 +779,28 @@ async def test_telegraph_upload(update: Update, context: ContextTypes.DEFAULT_TY
         logger.exception(f"测试过程中出错: {str(e)}")
         await update.message.reply_text(f'测试失败: {str(e)}')
 
+async def post_init(application) -> None:
+    """应用启动后初始化需要事件循环的资源"""
+    await http_client.start()
+    template_manager.precompile()
+
+async def post_shutdown(application) -> None:
+    """应用关闭时释放后台资源"""
+    await media_pipeline.shutdown()
+    await http_client.close()
+    sticker_converter.shutdown()
+    media_cache.close()
+    session_store.shutdown()
+
 def main() -> None:
-    application = ApplicationBuilder().token(TELEGRAM_BOT_TOKEN).build()
+    application = (
+        ApplicationBuilder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .concurrent_updates(CONCURRENT_UPDATES)
+        .build()
+    )
 
     # 添加命令处理器
     application.add_handler(CommandHandler('start', start))
@@ -740,7 +815,54 @@ def main() -> None:
         lambda u, c: test_telegraph_upload(u, c) if c.user_data.get('testing_telegraph') else handle_message(u, c)
     ))
 
-    application.run_polling()
+    if BOT_MODE == 'webhook':
+        asyncio.run(run_webhook(application))
+    else:
+        application.run_polling()
+
+async def run_webhook(application) -> None:
+    """
+    以 webhook 方式运行：由 aiohttp 服务接收 update，可以部署在反向代理之后，但只能运行单个副本
+    手动管理 Application 的生命周期，收到 SIGINT/SIGTERM 后停止
+    """
+    if not WEBHOOK_URL:
+        raise ValueError("webhook 模式需要配置 WEBHOOK_URL")
+    if not WEBHOOK_SECRET_TOKEN:
+        # 没有 secret token 时任何人都可以伪造允许会话的 update
+        raise ValueError("webhook 模式需要配置 WEBHOOK_SECRET_TOKEN")
+
+    server = WebhookServer(
+        application,
+        listen=WEBHOOK_LISTEN,
+        port=WEBHOOK_PORT,
+        path=WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET_TOKEN,
+        health_path=WEBHOOK_HEALTH_PATH
+    )
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    await application.initialize()
+    try:
+        await post_init(application)
+        await application.bot.set_webhook(
+            url=WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET_TOKEN,
+            allowed_updates=Update.ALL_TYPES
+        )
+        await application.start()
+        await server.start()
+        try:
+            await stop_event.wait()
+        finally:
+            await server.stop()
+            await application.stop()
+    finally:
+        await application.shutdown()
+        await post_shutdown(application)
 
 if __name__ == '__main__':
     main()
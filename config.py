@@ -10,7 +10,79 @@ TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 # 文件存储配置
 MEDIA_DIR = os.getenv('MEDIA_DIR', 'output/media')
 OUTPUT_DIR = os.getenv('OUTPUT_DIR', 'output')
+# 需要在重启和重建容器后保留的数据（会话数据库、媒体缓存、access_token），对应 docker-compose 挂载的 media 卷
+DATA_DIR = os.getenv('DATA_DIR', 'media')
 
 # 微信配置
 WECHAT_ACCESS_TOKEN = os.getenv('WECHAT_ACCESS_TOKEN')
-WECHAT_APPID = os.getenv('WECHAT_APPID') 
\ No newline at end of file
+WECHAT_APPID = os.getenv('WECHAT_APPID') 
+# 贴纸转码配置
+STICKER_WORKERS = int(os.getenv('STICKER_WORKERS', os.cpu_count() or 2))
+STICKER_QUEUE_SIZE = int(os.getenv('STICKER_QUEUE_SIZE', '16'))
+STICKER_TIMEOUT = float(os.getenv('STICKER_TIMEOUT', '60'))
+STICKER_MAX_WIDTH = int(os.getenv('STICKER_MAX_WIDTH', '320'))
+STICKER_FPS = float(os.getenv('STICKER_FPS', '10'))
+STICKER_MAX_FRAMES = int(os.getenv('STICKER_MAX_FRAMES', '100'))
+# 动态贴纸 GIF 的体积预算，不能超过 Telegraph 单文件 5MB 的上传限制（微信图片素材上限为 10MB）
+TELEGRAPH_MAX_BYTES = 5 * 1024 * 1024
+STICKER_MAX_BYTES = min(int(os.getenv('STICKER_MAX_BYTES', str(1024 * 1024))), TELEGRAPH_MAX_BYTES)
+
+# 媒体缓存配置
+MEDIA_CACHE_DIR = os.getenv('MEDIA_CACHE_DIR', os.path.join(DATA_DIR, 'cache'))
+MEDIA_CACHE_MAX_BYTES = int(os.getenv('MEDIA_CACHE_MAX_BYTES', str(512 * 1024 * 1024)))
+MEDIA_CACHE_TTL = float(os.getenv('MEDIA_CACHE_TTL', str(30 * 24 * 3600)))
+
+# HTTP 连接池配置
+HTTP_LIMIT = int(os.getenv('HTTP_LIMIT', '100'))
+HTTP_LIMIT_PER_HOST = int(os.getenv('HTTP_LIMIT_PER_HOST', '20'))
+HTTP_DNS_TTL = int(os.getenv('HTTP_DNS_TTL', '300'))
+HTTP_TIMEOUT = float(os.getenv('HTTP_TIMEOUT', '60'))
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', '10'))
+
+# 微信图片上传配置
+WECHAT_UPLOAD_CONCURRENCY = int(os.getenv('WECHAT_UPLOAD_CONCURRENCY', '5'))
+WECHAT_UPLOAD_RETRIES = int(os.getenv('WECHAT_UPLOAD_RETRIES', '2'))
+WECHAT_TOKEN_CACHE = os.getenv('WECHAT_TOKEN_CACHE', os.path.join(DATA_DIR, 'wechat_token.json'))
+
+# 媒体上传配置（Telegraph / Telegram / 微信共用）
+UPLOAD_RETRIES = int(os.getenv('UPLOAD_RETRIES', '2'))
+UPLOAD_BACKOFF = float(os.getenv('UPLOAD_BACKOFF', '1.0'))
+UPLOAD_BACKOFF_MAX = float(os.getenv('UPLOAD_BACKOFF_MAX', '30'))
+# 发布 Telegraph 文章时同时进行的页面请求数
+TELEGRAPH_PAGE_CONCURRENCY = int(os.getenv('TELEGRAPH_PAGE_CONCURRENCY', '3'))
+
+# 熔断配置：同一上游主机连续失败次数达到阈值后暂停请求，超时后放行试探请求
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', '5'))
+CIRCUIT_RESET_TIMEOUT = float(os.getenv('CIRCUIT_RESET_TIMEOUT', '30'))
+
+# 后台媒体预处理配置
+MEDIA_PIPELINE_WORKERS = int(os.getenv('MEDIA_PIPELINE_WORKERS', '2'))
+# 等待同一相册后续图片的时间（秒）
+ALBUM_WINDOW = float(os.getenv('ALBUM_WINDOW', '1.0'))
+
+# 同时处理的 update 数量，同一会话内的消息顺序由序号保证
+CONCURRENT_UPDATES = int(os.getenv('CONCURRENT_UPDATES', '64'))
+
+# 流式传输配置
+STREAM_CHUNK_SIZE = int(os.getenv('STREAM_CHUNK_SIZE', str(64 * 1024)))
+STREAM_SPILL_THRESHOLD = int(os.getenv('STREAM_SPILL_THRESHOLD', str(8 * 1024 * 1024)))
+
+# 记录会话存储配置（sqlite 或 memory）
+SESSION_STORE = os.getenv('SESSION_STORE', 'sqlite')
+SESSION_DB = os.getenv('SESSION_DB', os.path.join(DATA_DIR, 'sessions.sqlite3'))
+
+# 模板配置
+TEMPLATE_CACHE_DIR = os.getenv('TEMPLATE_CACHE_DIR', os.path.join(OUTPUT_DIR, 'template_cache'))
+TEMPLATE_COMPILED_DIR = os.getenv('TEMPLATE_COMPILED_DIR', '')
+TEMPLATE_AUTO_RELOAD = os.getenv('TEMPLATE_AUTO_RELOAD', 'true').lower() == 'true'
+
+# 运行模式：polling 或 webhook；两种模式都只能运行单个实例，记录会话的状态保存在进程内和本地数据库中
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+# webhook 配置，WEBHOOK_URL 为反向代理对外的地址（不含路径）
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+# webhook 模式必填，Telegram 在每个请求中带上该值，用于拒绝伪造的 update
+WEBHOOK_SECRET_TOKEN = os.getenv('WEBHOOK_SECRET_TOKEN')
+WEBHOOK_HEALTH_PATH = os.getenv('WEBHOOK_HEALTH_PATH', '/healthz')
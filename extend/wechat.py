@@ -1,10 +1,16 @@
 import requests
+import aiohttp
+import aiofiles
+import asyncio
 import json
+import time
 import urllib.request as urllib2
 import os
 from pprint import pprint
 import logging
 
+from utils.resilience import TransientError
+
 
 # 参考文档： https://developers.weixin.qq.com/doc/offiaccount/Draft_Box/Add_draft.html
 
@@ -47,7 +53,7 @@ class Wechat:
             raise ValueError(resp['errmsg'])
         return  resp['media_id']
     
-    def upload_media(self, file_path, mediaType='image'):
+    def upload_media(self, file_path, mediaType='image', _retried=False):
         logger.info(f"开始上传媒体文件: {file_path}, 类型: {mediaType}")
         
         if not os.path.exists(file_path):
@@ -73,10 +79,10 @@ class Wechat:
                 logger.info(f"上传响应: {result}")
                 
                 if 'media_id' not in result:
-                    if result.get('errcode') == 40001:
+                    if result.get('errcode') == 40001 and not _retried:
                         logger.info("Token 过期，尝试刷新...")
                         self.get_access_token()
-                        return self.upload_media(file_path, mediaType)
+                        return self.upload_media(file_path, mediaType, _retried=True)
                     logger.error(f"上传失败，返回结果中没有 media_id: {result}")
                     raise Exception(f"Upload failed: {result.get('errmsg', 'Unknown error')}")
                 
@@ -102,7 +108,6 @@ class Wechat:
         logger.info(f"发送草稿URL: {url}")
         
         try:
-            self.get_access_token()
             with open(html_file, 'r', encoding='utf-8') as f:
                 content = f.read()
             
@@ -144,6 +149,275 @@ class Wechat:
             logger.exception(f"发送草稿时发生错误: {str(e)}")
             raise
 
+class WechatTokenManager:
+    """
+    进程级共享的 access_token 缓存
+    在过期前主动刷新，并发请求只触发一次刷新，可持久化到文件以便重启后复用
+    """
+
+    TOKEN_URL = 'https://api.weixin.qq.com/cgi-bin/token'
+
+    def __init__(self, secret, wechat_appid, cache_file=None, refresh_margin=300):
+        """
+        :param secret: 公众号 AppSecret
+        :param wechat_appid: 公众号 AppID
+        :param cache_file: 持久化文件路径，为空则只缓存在内存中
+        :param refresh_margin: 提前刷新的秒数
+        """
+        self.secret = secret
+        self.wechat_appid = wechat_appid
+        self.cache_file = cache_file
+        self.refresh_margin = refresh_margin
+        self._token = None
+        self._expires_at = 0
+        self._lock = asyncio.Lock()
+        self._load()
+
+    def _valid(self):
+        return self._token is not None and time.time() < self._expires_at - self.refresh_margin
+
+    def _load(self):
+        if not self.cache_file or not os.path.exists(self.cache_file):
+            return
+        try:
+            with open(self.cache_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('appid') == self.wechat_appid:
+                self._token = data['access_token']
+                self._expires_at = data['expires_at']
+        except Exception as e:
+            logger.error(f"读取 access_token 缓存失败: {str(e)}")
+
+    def _save(self):
+        if not self.cache_file:
+            return
+        data = {'appid': self.wechat_appid, 'access_token': self._token, 'expires_at': self._expires_at}
+        tmp_path = f"{self.cache_file}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.cache_file) or '.', exist_ok=True)
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.cache_file)
+        except Exception as e:
+            logger.error(f"保存 access_token 缓存失败: {str(e)}")
+
+    async def _refresh(self, session):
+        params = {
+            'grant_type': 'client_credential',
+            'appid': self.wechat_appid,
+            'secret': self.secret
+        }
+        async with session.get(self.TOKEN_URL, params=params) as response:
+            data = await response.json(content_type=None)
+        if 'access_token' not in data:
+            logger.error(f"获取 access_token 失败: {data}")
+            raise Exception(f"Get access token failed: {data.get('errmsg', 'Unknown error')}")
+
+        self._token = data['access_token']
+        self._expires_at = time.time() + int(data.get('expires_in', 7200))
+        self._save()
+        logger.info(f"access_token 已刷新，有效期 {data.get('expires_in', 7200)} 秒")
+
+    async def get_token(self, session):
+        """返回有效的 access_token，必要时刷新"""
+        if self._valid():
+            return self._token
+        async with self._lock:
+            if not self._valid():
+                await self._refresh(session)
+            return self._token
+
+    async def invalidate(self, session, stale_token):
+        """
+        处理 40001（token 失效）
+        只有当前缓存的仍是失效的 token 时才刷新，避免并发请求重复刷新
+        """
+        async with self._lock:
+            if self._token == stale_token or not self._valid():
+                await self._refresh(session)
+            return self._token
+
+
+class WechatTokenExpiredError(Exception):
+    """流式上传时 access_token 已失效，token 已刷新，需要重新打开流上传"""
+
+
+# 微信接口的“系统繁忙”错误码，稍后重试可能成功
+WECHAT_BUSY_ERRCODE = -1
+
+
+class AsyncWechat:
+    """
+    基于 aiohttp 的异步微信客户端，接口与 Wechat 保持一致
+    文件以流的方式从磁盘读取并上传，连接由共享会话复用
+    """
+
+    API_BASE = 'https://api.weixin.qq.com/cgi-bin'
+    DRAFT_CHUNK_CHARS = 64 * 1024
+
+    def __init__(self, token, wechat_appid, session, token_manager=None):
+        self.access_token = token
+        self.wechat_appid = wechat_appid
+        self.access_token_2 = ""
+        self.session = session
+        self.token_manager = token_manager or WechatTokenManager(token, wechat_appid)
+
+    async def get_access_token(self):
+        self.access_token_2 = await self.token_manager.get_token(self.session)
+        return self.access_token_2
+
+    async def upload_image_to_wechat(self, imgpath):
+        logger.info(f"开始上传图片到微信: {imgpath}")
+        try:
+            return await self.upload_media(imgpath, mediaType='image')
+        except Exception as e:
+            logger.exception(f"上传图片到微信时发生错误: {str(e)}")
+            raise
+
+    async def upload_tmp_image(self, imgpath):
+        access_token = await self.get_access_token()
+        with open(imgpath, 'rb') as f:
+            form = aiohttp.FormData()
+            form.add_field('media', f, filename=os.path.basename(imgpath))
+            async with self.session.post(f'{self.API_BASE}/media/upload',
+                                         params=dict(access_token=access_token, type='thumb'),
+                                         data=form) as response:
+                resp = await response.json(content_type=None)
+
+        if 'errcode' in resp:
+            raise ValueError(resp['errmsg'])
+        return resp['media_id']
+
+    async def _post_material(self, access_token, mediaType, media, filename, content_type=None):
+        """以 multipart 方式提交永久素材，media 可以是文件对象或异步字节流"""
+        url = f"{self.API_BASE}/material/add_material"
+        params = {'access_token': access_token, 'type': mediaType}
+        form = aiohttp.FormData()
+        form.add_field('media', media, filename=filename, content_type=content_type)
+        async with self.session.post(url, params=params, data=form) as response:
+            logger.info(f"请求响应状态码: {response.status}")
+            if response.status != 200:
+                text = await response.text()
+                logger.error(f"上传失败，HTTP状态码: {response.status}, 响应内容: {text}")
+                error = TransientError if response.status >= 500 else Exception
+                raise error(f"Upload failed with status code: {response.status}")
+            result = await response.json(content_type=None)
+        logger.info(f"上传响应: {result}")
+        if result.get('errcode') == WECHAT_BUSY_ERRCODE:
+            raise TransientError(f"Upload failed: {result.get('errmsg', 'system busy')}")
+        return result
+
+    async def upload_media(self, file_path, mediaType='image'):
+        logger.info(f"开始上传媒体文件: {file_path}, 类型: {mediaType}")
+
+        if not os.path.exists(file_path):
+            logger.error(f"文件不存在: {file_path}")
+            raise FileNotFoundError(f"File not found: {file_path}")
+
+        # Token 过期时只刷新并重试一次
+        for attempt in range(2):
+            access_token = await self.get_access_token()
+            with open(file_path, 'rb') as f:
+                result = await self._post_material(access_token, mediaType, f, os.path.basename(file_path))
+
+            if 'media_id' in result:
+                logger.info(f"上传成功，media_id: {result['media_id']}")
+                return result['media_id'], result.get('url', '')
+
+            if result.get('errcode') == 40001 and attempt == 0:
+                logger.info("Token 过期，尝试刷新...")
+                await self.token_manager.invalidate(self.session, access_token)
+                continue
+
+            logger.error(f"上传失败，返回结果中没有 media_id: {result}")
+            raise Exception(f"Upload failed: {result.get('errmsg', 'Unknown error')}")
+
+    async def upload_media_stream(self, stream, filename, mediaType='image', content_type=None):
+        """
+        从异步字节流（如下载响应体）上传媒体文件，数据按块转发，不经过内存和磁盘
+        流只能读取一次，token 失效时刷新后直接抛出异常，由调用方重新打开流重试
+        """
+        logger.info(f"开始流式上传媒体文件: {filename}, 类型: {mediaType}")
+        access_token = await self.get_access_token()
+        result = await self._post_material(access_token, mediaType, stream, filename, content_type)
+
+        if 'media_id' in result:
+            logger.info(f"上传成功，media_id: {result['media_id']}")
+            return result['media_id'], result.get('url', '')
+
+        if result.get('errcode') == 40001:
+            logger.info("Token 过期，刷新后需要重新上传")
+            await self.token_manager.invalidate(self.session, access_token)
+            raise WechatTokenExpiredError(f"Upload failed: {result.get('errmsg', 'access_token expired')}")
+
+        logger.error(f"上传失败，返回结果中没有 media_id: {result}")
+        raise Exception(f"Upload failed: {result.get('errmsg', 'Unknown error')}")
+
+    async def _stream_draft_body(self, html_file, article):
+        """
+        按块生成草稿请求的 JSON 请求体，文章 HTML 从文件分块读取并转义，
+        不在内存中保存完整的文章和 JSON 字符串
+        """
+        head = '{"articles": [' + json.dumps(article, ensure_ascii=False)[:-1] + ', "content": "'
+        yield head.encode('utf-8')
+        async with aiofiles.open(html_file, 'r', encoding='utf-8') as f:
+            while True:
+                chunk = await f.read(self.DRAFT_CHUNK_CHARS)
+                if not chunk:
+                    break
+                # 逐块转义后去掉两侧引号，拼接结果与整体转义一致
+                yield json.dumps(chunk, ensure_ascii=False)[1:-1].encode('utf-8')
+        yield '"}]}'.encode('utf-8')
+
+    async def send_draft(self, html_file, thumb_media_id):
+        logger.info(f"开始发送草稿: {html_file}, 缩略图ID: {thumb_media_id}")
+
+        if not os.path.exists(html_file):
+            logger.error(f"HTML文件不存在: {html_file}")
+            raise FileNotFoundError(f"HTML file not found: {html_file}")
+
+        if isinstance(thumb_media_id, tuple):
+            logger.info(f"从元组中提取 media_id: {thumb_media_id[0]}")
+            thumb_media_id = thumb_media_id[0]
+
+        article = {
+            "title": "消息记录",
+            "author": "Bot",
+            "digest": "消息记录",
+            "thumb_media_id": thumb_media_id
+        }
+        headers = {'Content-Type': 'application/json; charset=utf-8'}
+
+        url = f"{self.API_BASE}/draft/add"
+        # Token 过期时只刷新并重试一次
+        for attempt in range(2):
+            access_token = await self.get_access_token()
+            logger.info("开始发送草稿请求...")
+            send_data = self._stream_draft_body(html_file, article)
+            async with self.session.post(url, params={'access_token': access_token},
+                                         headers=headers, data=send_data) as response:
+                logger.info(f"草稿请求响应状态码: {response.status}")
+                if response.status != 200:
+                    text = await response.text()
+                    logger.error(f"发送草稿失败，HTTP状态码: {response.status}, 响应内容: {text}")
+                    error = TransientError if response.status >= 500 else Exception
+                    raise error(f"Send draft failed with status code: {response.status}")
+                result = await response.json(content_type=None)
+
+            logger.info(f"发送草稿响应: {result}")
+            if result.get('errcode') == 40001 and attempt == 0:
+                logger.info("Token 过期，尝试刷新...")
+                await self.token_manager.invalidate(self.session, access_token)
+                continue
+            break
+
+        if result.get('errcode', 0) != 0:
+            logger.error(f"发送草稿失败: {result}")
+            raise Exception(f"Send draft failed: {result.get('errmsg', 'Unknown error')}")
+
+        logger.info("草稿发送成功")
+        return result
+
 if __name__ == "__main__":
     from dotenv import load_dotenv
 
@@ -0,0 +1,147 @@
+import asyncio
+import os
+import tempfile
+import unittest
+
+from utils.chat_sequencer import ChatSequencer
+from utils.recorded_message import RecordedMessage
+from utils.session_store import SqliteSessionStore
+
+
+def text(content: str) -> RecordedMessage:
+    return RecordedMessage(time='2024-01-01 00:00:00', content=content)
+
+
+class ChatSequencerSqliteTest(unittest.TestCase):
+    """ChatSequencer 与 SqliteSessionStore 配合时的消息顺序"""
+
+    CHAT_ID = 42
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self._tmp.name, 'sessions.sqlite3')
+        self.store = SqliteSessionStore(self.db_path)
+        self.sequencer = ChatSequencer(self.store)
+        self.store.open(self.CHAT_ID)
+
+    def tearDown(self):
+        self.store.shutdown()
+        self._tmp.cleanup()
+
+    def contents(self, store=None):
+        return [msg.content for msg in (store or self.store).load(self.CHAT_ID)]
+
+    def test_out_of_order_fill_keeps_message_order(self):
+        first = self.sequencer.reserve(self.CHAT_ID, 100)
+        second = self.sequencer.reserve(self.CHAT_ID, 101)
+        third = self.sequencer.reserve(self.CHAT_ID, 102)
+
+        self.sequencer.fill(third, text('c'))
+        self.sequencer.fill(first, text('a'))
+        self.sequencer.fill(second, text('b'))
+
+        self.assertEqual(self.contents(), ['a', 'b', 'c'])
+        self.assertEqual([first.index, second.index, third.index], [0, 1, 2])
+
+    def test_seq_orders_messages_reserved_out_of_order(self):
+        late = self.sequencer.reserve(self.CHAT_ID, 200)
+        early = self.sequencer.reserve(self.CHAT_ID, 199)
+        self.sequencer.fill(late, text('late'))
+        self.sequencer.fill(early, text('early'))
+
+        self.assertEqual(self.contents(), ['early', 'late'])
+
+    def test_unfilled_slots_are_hidden_until_filled(self):
+        first = self.sequencer.reserve(self.CHAT_ID, 1)
+        second = self.sequencer.reserve(self.CHAT_ID, 2)
+        self.sequencer.fill(second, text('b'))
+
+        self.assertEqual(self.contents(), ['b'])
+        self.sequencer.fill(first, text('a'))
+        self.assertEqual(self.contents(), ['a', 'b'])
+
+    def test_release_discards_unfilled_slot(self):
+        failed = self.sequencer.reserve(self.CHAT_ID, 1)
+        kept = self.sequencer.reserve(self.CHAT_ID, 2)
+        self.sequencer.fill(kept, text('kept'))
+
+        self.sequencer.release(failed)
+        self.sequencer.release(kept)
+
+        self.assertEqual(self.contents(), ['kept'])
+        self.assertEqual(self.store.count(self.CHAT_ID), 1)
+
+    def test_release_keeps_filled_slot(self):
+        slot = self.sequencer.reserve(self.CHAT_ID, 1)
+        self.sequencer.fill(slot, text('a'))
+        self.sequencer.release(slot)
+
+        self.assertEqual(self.contents(), ['a'])
+        self.assertEqual(self.store.count(self.CHAT_ID), 1)
+
+    def test_background_update_replaces_content(self):
+        slot = self.sequencer.reserve(self.CHAT_ID, 1)
+        message_id = self.sequencer.fill(slot, text('a'))
+        message = text('a')
+        message.telegraph_url = 'https://telegra.ph/file/a.jpg'
+        self.store.update(message_id, message)
+
+        self.assertEqual(self.store.load(self.CHAT_ID)[0].telegraph_url, 'https://telegra.ph/file/a.jpg')
+
+    def test_reload_after_restart(self):
+        first = self.sequencer.reserve(self.CHAT_ID, 10)
+        self.sequencer.reserve(self.CHAT_ID, 11)  # 重启前没有写入
+        third = self.sequencer.reserve(self.CHAT_ID, 12)
+        self.sequencer.fill(third, text('c'))
+        self.sequencer.fill(first, text('a'))
+
+        self.store.shutdown()
+        self.store = SqliteSessionStore(self.db_path)
+        self.sequencer = ChatSequencer(self.store)
+
+        # 未写入的预留位置在重启时被清理
+        self.assertTrue(self.store.is_open(self.CHAT_ID))
+        self.assertEqual(self.store.count(self.CHAT_ID), 2)
+        self.assertEqual(self.contents(), ['a', 'c'])
+
+        # 重启后继续记录，新消息排在原有消息之后
+        slot = self.sequencer.reserve(self.CHAT_ID, 13)
+        self.assertEqual(slot.index, 2)
+        self.sequencer.fill(slot, text('d'))
+        self.assertEqual(self.contents(), ['a', 'c', 'd'])
+
+    def test_close_removes_session(self):
+        slot = self.sequencer.reserve(self.CHAT_ID, 1)
+        self.sequencer.fill(slot, text('a'))
+        self.store.close(self.CHAT_ID)
+
+        self.assertFalse(self.store.is_open(self.CHAT_ID))
+        self.assertEqual(self.contents(), [])
+
+    def test_wait_returns_after_all_slots_released(self):
+        async def scenario():
+            first = self.sequencer.reserve(self.CHAT_ID, 1)
+            second = self.sequencer.reserve(self.CHAT_ID, 2)
+            waiter = asyncio.create_task(self.sequencer.wait(self.CHAT_ID))
+
+            await asyncio.sleep(0)
+            self.sequencer.fill(first, text('a'))
+            self.sequencer.release(first)
+            await asyncio.sleep(0)
+            self.assertFalse(waiter.done())
+
+            self.sequencer.release(second)
+            await asyncio.wait_for(waiter, timeout=1)
+
+        asyncio.run(scenario())
+        self.assertEqual(self.contents(), ['a'])
+
+    def test_closing_flag_is_scoped(self):
+        self.assertFalse(self.sequencer.is_closing(self.CHAT_ID))
+        with self.sequencer.closing(self.CHAT_ID):
+            self.assertTrue(self.sequencer.is_closing(self.CHAT_ID))
+        self.assertFalse(self.sequencer.is_closing(self.CHAT_ID))
+
+
+if __name__ == '__main__':
+    unittest.main()
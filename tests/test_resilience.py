@@ -0,0 +1,210 @@
+import asyncio
+import unittest
+from unittest import mock
+
+from utils.resilience import (
+    CONNECT_ERRORS, CircuitBreaker, CircuitOpenError, DownloadError, RetryAfterError, TransientError,
+    call_with_retry, parse_retry_after
+)
+
+
+class FakeClock:
+    """替代 time.monotonic，手动推进时间"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class CircuitBreakerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch('utils.resilience.time.monotonic', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = CircuitBreaker('example.com', failure_threshold=3, reset_timeout=30)
+
+    def test_opens_after_threshold(self):
+        for _ in range(2):
+            self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.breaker.before_call()
+
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.before_call()
+
+    def test_success_resets_failure_count(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.breaker.record_success()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_half_open_allows_one_probe_per_timeout(self):
+        for _ in range(3):
+            self.breaker.record_failure()
+
+        self.clock.now += 30
+        self.breaker.before_call()
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        # 试探请求未完成时，其他请求仍然被拒绝
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.before_call()
+
+    def test_half_open_probe_success_closes(self):
+        for _ in range(3):
+            self.breaker.record_failure()
+        self.clock.now += 30
+        self.breaker.before_call()
+
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.breaker.before_call()
+
+    def test_half_open_probe_failure_reopens(self):
+        for _ in range(3):
+            self.breaker.record_failure()
+        self.clock.now += 30
+        self.breaker.before_call()
+
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.before_call()
+        self.clock.now += 30
+        self.breaker.before_call()
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+
+
+class CallWithRetryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.breaker = CircuitBreaker('example.com', failure_threshold=3, reset_timeout=30)
+        self.sleeps = []
+
+        async def fake_sleep(delay):
+            self.sleeps.append(delay)
+
+        patcher = mock.patch('utils.resilience.asyncio.sleep', fake_sleep)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def call(self, func, **kwargs):
+        kwargs.setdefault('retries', 2)
+        kwargs.setdefault('base_delay', 1.0)
+        kwargs.setdefault('max_delay', 10.0)
+        kwargs.setdefault('breaker', self.breaker)
+        return asyncio.run(call_with_retry(func, **kwargs))
+
+    def failing(self, *errors, result='ok'):
+        """依次抛出 errors 中的异常，之后返回 result，calls 记录调用次数"""
+        calls = []
+
+        async def func():
+            calls.append(1)
+            if len(calls) <= len(errors):
+                raise errors[len(calls) - 1]
+            return result
+
+        return func, calls
+
+    def test_retries_transient_errors_then_succeeds(self):
+        func, calls = self.failing(TransientError('502'), asyncio.TimeoutError())
+        self.assertEqual(self.call(func), 'ok')
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(len(self.sleeps), 2)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_gives_up_after_retries(self):
+        func, calls = self.failing(*(TransientError('502') for _ in range(5)))
+        breaker = CircuitBreaker('example.com', failure_threshold=10)
+        with self.assertRaises(TransientError):
+            self.call(func, breaker=breaker)
+        self.assertEqual(len(calls), 3)
+
+    def test_local_errors_are_not_retried_or_counted(self):
+        func, calls = self.failing(FileNotFoundError('missing'))
+        for _ in range(5):
+            calls.clear()
+            with self.assertRaises(FileNotFoundError):
+                self.call(func)
+            self.assertEqual(len(calls), 1)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.assertEqual(self.sleeps, [])
+
+    def test_business_errors_are_not_retried_or_counted(self):
+        func, calls = self.failing(ValueError('invalid media type'))
+        with self.assertRaises(ValueError):
+            self.call(func)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(self.breaker._failures, 0)
+
+    def test_download_errors_are_retried_but_not_counted(self):
+        func, calls = self.failing(DownloadError('telegram down'), DownloadError('telegram down'))
+        self.assertEqual(self.call(func, retry_on=(DownloadError, *CONNECT_ERRORS)), 'ok')
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(self.breaker._failures, 0)
+
+    def test_retry_on_limits_retries_but_breaker_still_counts(self):
+        # 非幂等接口只在连接错误时重试，读超时直接失败，但仍计入熔断
+        func, calls = self.failing(asyncio.TimeoutError())
+        with self.assertRaises(asyncio.TimeoutError):
+            self.call(func, retry_on=CONNECT_ERRORS)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(self.breaker._failures, 1)
+
+    def test_retry_after_is_respected(self):
+        func, calls = self.failing(RetryAfterError('429', 4.0))
+        self.assertEqual(self.call(func), 'ok')
+        self.assertEqual(self.sleeps, [4.0])
+
+    def test_retry_after_longer_than_max_delay_fails_fast(self):
+        func, calls = self.failing(RetryAfterError('429', 60.0))
+        with self.assertRaises(RetryAfterError):
+            self.call(func)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(self.sleeps, [])
+
+    def test_stops_retrying_when_breaker_opens(self):
+        breaker = CircuitBreaker('example.com', failure_threshold=1)
+        func, calls = self.failing(TransientError('503'), TransientError('503'))
+        with self.assertRaises(TransientError):
+            self.call(func, breaker=breaker)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+        with self.assertRaises(CircuitOpenError):
+            self.call(func, breaker=breaker)
+        self.assertEqual(len(calls), 1)
+
+    def test_backoff_stays_within_cap(self):
+        func, calls = self.failing(*(TransientError('502') for _ in range(6)))
+        with self.assertRaises(TransientError):
+            self.call(func, retries=5, base_delay=1.0, max_delay=3.0,
+                      breaker=CircuitBreaker('example.com', failure_threshold=10))
+        self.assertEqual(len(self.sleeps), 5)
+        for attempt, delay in enumerate(self.sleeps):
+            self.assertGreaterEqual(delay, 0)
+            self.assertLessEqual(delay, min(3.0, 2 ** attempt))
+
+
+class ParseRetryAfterTest(unittest.TestCase):
+
+    def test_seconds(self):
+        self.assertEqual(parse_retry_after('5'), 5.0)
+
+    def test_http_date_in_the_past(self):
+        self.assertEqual(parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT'), 0.0)
+
+    def test_invalid(self):
+        self.assertIsNone(parse_retry_after(None))
+        self.assertIsNone(parse_retry_after('soon'))
+
+
+if __name__ == '__main__':
+    unittest.main()
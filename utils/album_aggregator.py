@@ -0,0 +1,110 @@
+import asyncio
+import bisect
+import functools
+import logging
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from utils.chat_sequencer import Slot
+from utils.recorded_message import RecordedMessage
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _PendingAlbum:
+    chat_id: int
+    entry: RecordedMessage
+    message_id: int
+    seqs: List[int] = field(default_factory=list)
+    jobs: List[Callable[..., Awaitable]] = field(default_factory=list)
+    handle: Optional[asyncio.TimerHandle] = None
+
+
+class AlbumAggregator:
+    """
+    相册聚合器
+    相册的每张图片作为独立的 update 到达，共享同一个 media_group_id；
+    第一张图片的预留位置写入一条 type='album' 的记录，之后的图片按序号插入该记录，
+    窗口期内没有新图片时把整组图片的后台任务一起提交并发处理
+    """
+
+    def __init__(self, session_store, media_pipeline, window: float = 1.0):
+        """
+        :param session_store: 会话存储
+        :param media_pipeline: 后台媒体处理队列
+        :param window: 等待同组后续图片的时间（秒）
+        """
+        self.session_store = session_store
+        self.media_pipeline = media_pipeline
+        self.window = window
+        self._pending: Dict[str, _PendingAlbum] = {}
+
+    def add(self, chat_id: int, media_group_id: str, item: RecordedMessage, slot: Slot,
+            job: Optional[Callable[..., Awaitable]] = None) -> None:
+        """
+        添加相册中的一张图片
+        :param slot: 图片到达时预留的位置，只有相册的第一张图片会使用，其余的由调用方释放
+        :param job: 图片的后台任务，以 message_id 和 entry 关键字参数调用
+        """
+        pending = self._pending.get(media_group_id)
+        if pending is None:
+            entry = RecordedMessage(
+                time=item.time,
+                type='album',
+                media_group_id=media_group_id,
+                forward_from=item.forward_from,
+                forward_date=item.forward_date
+            )
+            self.session_store.update(slot.message_id, entry)
+            slot.filled = True
+            pending = _PendingAlbum(chat_id, entry, slot.message_id)
+            self._pending[media_group_id] = pending
+        else:
+            pending.handle.cancel()
+
+        # 并发处理时图片可能乱序到达，按序号插入
+        index = bisect.bisect(pending.seqs, slot.seq)
+        pending.seqs.insert(index, slot.seq)
+        pending.entry.items.insert(index, item)
+        if job:
+            pending.jobs.append(job)
+        pending.handle = asyncio.get_running_loop().call_later(self.window, self._flush, media_group_id)
+
+    def _flush(self, media_group_id: str) -> None:
+        pending = self._pending.pop(media_group_id, None)
+        if pending is None:
+            return
+        pending.handle.cancel()
+        logger.info(f"相册 {media_group_id} 收集完成，共 {len(pending.entry.items)} 张图片")
+
+        self.session_store.update(pending.message_id, pending.entry)
+        if pending.jobs:
+            self.media_pipeline.submit(
+                pending.chat_id,
+                functools.partial(self._process, pending.entry, pending.message_id, pending.jobs)
+            )
+
+    async def _process(self, entry: RecordedMessage, message_id: int,
+                       jobs: List[Callable[..., Awaitable]]) -> None:
+        """并发处理整组图片"""
+        results = await asyncio.gather(
+            *(job(message_id=message_id, entry=entry) for job in jobs),
+            return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                logger.error(f"处理相册图片失败: {str(result)}")
+
+    def flush(self, chat_id: int) -> None:
+        """立即结束该会话中所有正在收集的相册"""
+        for media_group_id, pending in list(self._pending.items()):
+            if pending.chat_id == chat_id:
+                self._flush(media_group_id)
+
+    def cancel(self, chat_id: int) -> None:
+        """丢弃该会话中正在收集的相册"""
+        for media_group_id, pending in list(self._pending.items()):
+            if pending.chat_id == chat_id:
+                pending.handle.cancel()
+                del self._pending[media_group_id]
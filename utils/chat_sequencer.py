@@ -0,0 +1,84 @@
+import asyncio
+import contextlib
+import logging
+from dataclasses import dataclass
+from typing import Dict, Iterator, Set
+
+from utils.recorded_message import RecordedMessage
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Slot:
+    """
+    会话中预留的一条消息位置
+    index 为预留时会话中已有的消息数，filled 表示是否已写入消息，未写入的位置在释放时删除
+    """
+
+    chat_id: int
+    message_id: int
+    seq: int
+    index: int
+    filled: bool = False
+
+
+class ChatSequencer:
+    """
+    按会话控制消息的记录顺序
+    消息到达时以 Telegram message_id 作为序号预留位置，处理完成后写入，
+    允许 Application 并发处理 update，同时保证最终文章中的消息顺序与发送顺序一致；
+    同一会话的 /start、/end 通过 command_lock 串行执行，结束记录期间不再接收新消息
+    """
+
+    def __init__(self, session_store):
+        self.session_store = session_store
+        self._inflight: Dict[int, int] = {}
+        self._idle: Dict[int, asyncio.Event] = {}
+        self._locks: Dict[int, asyncio.Lock] = {}
+        self._closing: Set[int] = set()
+
+    def command_lock(self, chat_id: int) -> asyncio.Lock:
+        """同一会话的命令锁，/start 和 /end 持有该锁，避免同时读写同一会话"""
+        return self._locks.setdefault(chat_id, asyncio.Lock())
+
+    def is_closing(self, chat_id: int) -> bool:
+        return chat_id in self._closing
+
+    @contextlib.contextmanager
+    def closing(self, chat_id: int) -> Iterator[None]:
+        """标记会话正在结束，期间 is_closing 为真，新消息应被拒绝"""
+        self._closing.add(chat_id)
+        try:
+            yield
+        finally:
+            self._closing.discard(chat_id)
+
+    def reserve(self, chat_id: int, seq: int) -> Slot:
+        """在消息到达时调用，必须在第一次 await 之前完成"""
+        index = self.session_store.count(chat_id)
+        slot = Slot(chat_id, self.session_store.reserve(chat_id, seq), seq, index)
+        self._inflight[chat_id] = self._inflight.get(chat_id, 0) + 1
+        self._idle.setdefault(chat_id, asyncio.Event()).clear()
+        return slot
+
+    def fill(self, slot: Slot, message: RecordedMessage) -> int:
+        """写入处理完成的消息，返回消息 ID"""
+        self.session_store.update(slot.message_id, message)
+        slot.filled = True
+        return slot.message_id
+
+    def release(self, slot: Slot) -> None:
+        """处理结束（无论成功与否）时调用，未写入的位置被删除"""
+        if not slot.filled:
+            self.session_store.discard(slot.chat_id, slot.message_id)
+        self._inflight[slot.chat_id] -= 1
+        if self._inflight[slot.chat_id] == 0:
+            del self._inflight[slot.chat_id]
+            self._idle.pop(slot.chat_id).set()
+
+    async def wait(self, chat_id: int) -> None:
+        """等待该会话中正在处理的消息全部写入"""
+        event = self._idle.get(chat_id)
+        if event is not None:
+            await event.wait()
@@ -0,0 +1,48 @@
+import logging
+from typing import Optional
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+
+class HttpClient:
+    """
+    应用级共享的 HTTP 客户端
+    所有上传、下载共用一个 ClientSession，复用 TCP/TLS 连接和 DNS 缓存
+    """
+
+    def __init__(self, limit: int = 100, limit_per_host: int = 20, dns_ttl: int = 300,
+                 total_timeout: float = 60, connect_timeout: float = 10, keepalive_timeout: float = 30):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.dns_ttl = dns_ttl
+        self.total_timeout = total_timeout
+        self.connect_timeout = connect_timeout
+        self.keepalive_timeout = keepalive_timeout
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def start(self) -> aiohttp.ClientSession:
+        """创建共享会话，需在事件循环中调用（Application.post_init）"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                ttl_dns_cache=self.dns_ttl,
+                keepalive_timeout=self.keepalive_timeout,
+            )
+            timeout = aiohttp.ClientTimeout(total=self.total_timeout, connect=self.connect_timeout)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+            logger.info(f"HTTP 连接池已创建: limit={self.limit}, limit_per_host={self.limit_per_host}")
+        return self._session
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            raise RuntimeError("HTTP 客户端尚未启动")
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
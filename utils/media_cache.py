@@ -0,0 +1,178 @@
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class MediaCache:
+    """
+    以 Telegram file_unique_id 为键的媒体缓存
+    记录转换后的本地文件、telegra.ph URL 以及微信 media_id/URL，
+    重复的贴纸和转发图片可以跳过下载、转码和上传
+    """
+
+    FIELDS = ('path', 'telegraph_url', 'wechat_media_id', 'wechat_url')
+
+    def __init__(self, cache_dir: str, max_bytes: int, ttl: float):
+        """
+        :param cache_dir: 缓存目录，索引数据库和文件都保存在这里
+        :param max_bytes: 缓存文件总大小上限，超出后按最近最少使用淘汰
+        :param ttl: 缓存条目有效期（秒）
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        # 命中时只在内存中记录访问时间，随下一次写入或淘汰批量落盘，查询不产生磁盘写入
+        self._touched = {}
+        self._conn = sqlite3.connect(os.path.join(cache_dir, 'index.sqlite3'), check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS media (
+                file_unique_id TEXT PRIMARY KEY,
+                path TEXT,
+                telegraph_url TEXT,
+                wechat_media_id TEXT,
+                wechat_url TEXT,
+                size INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_media_last_access ON media(last_access)')
+        self._conn.commit()
+        self.evict()
+
+    def get(self, file_unique_id: str) -> Optional[dict]:
+        """查询缓存条目，过期或文件丢失的条目视为未命中"""
+        if not file_unique_id:
+            return None
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT path, telegraph_url, wechat_media_id, wechat_url, created_at '
+                'FROM media WHERE file_unique_id = ?',
+                (file_unique_id,)
+            ).fetchone()
+            if row is None:
+                return None
+
+            now = time.time()
+            if now - row[4] > self.ttl:
+                self._delete(file_unique_id, row[0])
+                self._conn.commit()
+                return None
+
+            entry = dict(zip(self.FIELDS, row[:4]))
+            if entry['path'] and not os.path.exists(entry['path']):
+                entry['path'] = None
+
+            self._touched[file_unique_id] = now
+        return entry
+
+    def put(self, file_unique_id: str, **fields) -> None:
+        """新增或更新缓存条目，只覆盖传入的字段"""
+        if not file_unique_id:
+            return
+        unknown = set(fields) - set(self.FIELDS)
+        if unknown:
+            raise ValueError(f"未知的缓存字段: {unknown}")
+
+        now = time.time()
+        size = None
+        if fields.get('path'):
+            size = os.path.getsize(fields['path'])
+
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR IGNORE INTO media (file_unique_id, created_at, last_access) VALUES (?, ?, ?)',
+                (file_unique_id, now, now)
+            )
+            for name, value in fields.items():
+                self._conn.execute(f'UPDATE media SET {name} = ? WHERE file_unique_id = ?', (value, file_unique_id))
+            if size is not None:
+                self._conn.execute('UPDATE media SET size = ? WHERE file_unique_id = ?', (size, file_unique_id))
+            self._touched[file_unique_id] = now
+            self._flush_access()
+            self._conn.commit()
+
+        if size is not None:
+            self.evict()
+
+    def store_file(self, file_unique_id: str, src_path: str) -> str:
+        """
+        把转换好的文件移动到缓存目录并登记，返回缓存中的路径
+        源文件可能在另一个文件系统上，先移动为临时文件再原子替换，读取方不会看到写了一半的文件
+        """
+        ext = os.path.splitext(src_path)[1]
+        dst_path = os.path.join(self.cache_dir, f"{file_unique_id}{ext}")
+        tmp_path = f"{dst_path}.{uuid.uuid4().hex}.tmp"
+        shutil.move(src_path, tmp_path)
+        os.replace(tmp_path, dst_path)
+        self.put(file_unique_id, path=dst_path)
+        return dst_path
+
+    def owns(self, path: Optional[str]) -> bool:
+        """判断文件是否由缓存管理（调用方不应删除）"""
+        if not path:
+            return False
+        return os.path.abspath(path).startswith(os.path.abspath(self.cache_dir) + os.sep)
+
+    def evict(self) -> None:
+        """清理过期条目，并在超出容量时按最近最少使用淘汰"""
+        with self._lock:
+            self._flush_access()
+            expired = self._conn.execute(
+                'SELECT file_unique_id, path FROM media WHERE created_at < ?',
+                (time.time() - self.ttl,)
+            ).fetchall()
+            for file_unique_id, path in expired:
+                self._delete(file_unique_id, path)
+
+            total = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM media').fetchone()[0]
+            if total > self.max_bytes:
+                rows = self._conn.execute(
+                    'SELECT file_unique_id, path, size FROM media WHERE size > 0 ORDER BY last_access'
+                ).fetchall()
+                for file_unique_id, path, size in rows:
+                    if total <= self.max_bytes:
+                        break
+                    self._delete(file_unique_id, path)
+                    total -= size
+            self._conn.commit()
+
+        if expired:
+            logger.info(f"清理过期缓存条目: {len(expired)}")
+
+    def _flush_access(self) -> None:
+        """把内存中累积的访问时间写入索引，调用方持有锁并负责提交"""
+        if self._touched:
+            self._conn.executemany(
+                'UPDATE media SET last_access = ? WHERE file_unique_id = ?',
+                [(last_access, file_unique_id) for file_unique_id, last_access in self._touched.items()]
+            )
+            self._touched.clear()
+
+    def _delete(self, file_unique_id: str, path: Optional[str]) -> None:
+        self._conn.execute('DELETE FROM media WHERE file_unique_id = ?', (file_unique_id,))
+        if path:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logger.error(f"删除缓存文件失败: {str(e)}")
+
+    def close(self) -> None:
+        with self._lock:
+            self._flush_access()
+            self._conn.commit()
+            self._conn.close()
@@ -0,0 +1,59 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List
+
+logger = logging.getLogger(__name__)
+
+
+class MediaPipeline:
+    """
+    按会话划分的后台媒体处理队列
+    记录过程中提前下载、上传媒体，/end 时只需等待队列清空
+    """
+
+    def __init__(self, workers_per_chat: int = 2):
+        self.workers_per_chat = workers_per_chat
+        self._queues: Dict[int, asyncio.Queue] = {}
+        self._workers: Dict[int, List[asyncio.Task]] = {}
+
+    def submit(self, chat_id: int, job: Callable[[], Awaitable]) -> None:
+        """把任务加入该会话的队列，首次提交时启动后台 worker"""
+        queue = self._queues.get(chat_id)
+        if queue is None:
+            queue = asyncio.Queue()
+            self._queues[chat_id] = queue
+            self._workers[chat_id] = [
+                asyncio.create_task(self._worker(chat_id, queue))
+                for _ in range(self.workers_per_chat)
+            ]
+        queue.put_nowait(job)
+
+    async def _worker(self, chat_id: int, queue: asyncio.Queue) -> None:
+        while True:
+            job = await queue.get()
+            try:
+                await job()
+            except Exception as e:
+                logger.exception(f"后台处理媒体失败 chat_id={chat_id}: {str(e)}")
+            finally:
+                queue.task_done()
+
+    async def drain(self, chat_id: int) -> None:
+        """等待该会话的所有任务完成，然后停止 worker"""
+        queue = self._queues.get(chat_id)
+        if queue is None:
+            return
+        await queue.join()
+        self.cancel(chat_id)
+
+    def cancel(self, chat_id: int) -> None:
+        """丢弃该会话未完成的任务"""
+        self._queues.pop(chat_id, None)
+        for task in self._workers.pop(chat_id, []):
+            task.cancel()
+
+    async def shutdown(self) -> None:
+        tasks = [task for workers in self._workers.values() for task in workers]
+        for chat_id in list(self._queues):
+            self.cancel(chat_id)
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,264 @@
+import asyncio
+import contextlib
+import logging
+import mimetypes
+import os
+import time
+from abc import ABC, abstractmethod
+from dataclasses import asdict, dataclass
+from typing import Dict, Iterable, Optional, Union
+
+import aiohttp
+
+from extend.wechat import AsyncWechat, WechatTokenExpiredError
+from utils.http_client import HttpClient
+from utils.resilience import (
+    CONNECT_ERRORS, TRANSIENT_ERRORS, CircuitBreakerRegistry, CircuitOpenError, RetryAfterError, TransientError,
+    call_with_retry, parse_retry_after
+)
+
+logger = logging.getLogger(__name__)
+
+# 待上传的媒体：内存中的内容或本地文件路径
+Media = Union[bytes, str]
+
+
+@dataclass
+class UploadResult:
+    url: str
+    media_id: Optional[str] = None
+
+
+@dataclass
+class UploadStats:
+    attempts: int = 0
+    successes: int = 0
+    failures: int = 0
+    rejected: int = 0
+    bytes: int = 0
+    seconds: float = 0.0
+
+
+class UploadError(Exception):
+    """上传目标返回了无法使用的结果"""
+
+
+def _open_media(media: Media):
+    """内存中的内容直接使用，本地文件在 with 块中打开，上传结束后关闭"""
+    if isinstance(media, (bytes, bytearray)):
+        return contextlib.nullcontext(media)
+    return open(media, 'rb')
+
+
+def _media_size(media: Media) -> int:
+    if isinstance(media, (bytes, bytearray)):
+        return len(media)
+    return os.path.getsize(media)
+
+
+def _filename(media: Media, mime: str, filename: Optional[str]) -> str:
+    if filename:
+        return filename
+    if isinstance(media, str):
+        return os.path.basename(media)
+    return f"upload{mimetypes.guess_extension(mime) or ''}"
+
+
+class UploadBackend(ABC):
+    """
+    上传目标接口
+    :param semaphore: 限制该目标并发上传数的信号量，为空时不限制
+    """
+
+    name = ''
+    # 上游主机，同一主机的目标共享熔断器
+    host = ''
+    # 重复上传是否无副作用；非幂等的目标只在连接未建立或被限流拒绝时重试，避免产生重复的文档或素材
+    idempotent = True
+
+    def __init__(self, semaphore: Optional[asyncio.Semaphore] = None):
+        self.semaphore = semaphore
+
+    @abstractmethod
+    async def upload(self, media: Media, mime: str, filename: str) -> UploadResult:
+        """上传媒体，返回可访问的 URL"""
+
+
+class TelegraphBackend(UploadBackend):
+    """telegra.ph 图床"""
+
+    name = 'telegraph'
+    host = 'telegra.ph'
+    UPLOAD_URL = 'https://telegra.ph/upload'
+
+    def __init__(self, http_client: HttpClient, semaphore: Optional[asyncio.Semaphore] = None):
+        super().__init__(semaphore)
+        self.http_client = http_client
+
+    async def upload(self, media: Media, mime: str, filename: str) -> UploadResult:
+        form = aiohttp.FormData()
+        with _open_media(media) as payload:
+            form.add_field('file', payload, filename=filename, content_type=mime)
+            async with self.http_client.session.post(self.UPLOAD_URL, data=form) as response:
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                if response.status == 429 and retry_after is not None:
+                    raise RetryAfterError(f"Telegraph 限流，{retry_after} 秒后重试", retry_after)
+                if response.status != 200:
+                    error = TransientError if response.status >= 500 else UploadError
+                    raise error(f"Telegraph 上传失败，状态码: {response.status}, 响应: {await response.text()}")
+                result = await response.json(content_type=None)
+
+        if isinstance(result, list) and result and result[0].get('src'):
+            return UploadResult(f"https://telegra.ph{result[0]['src']}")
+        raise UploadError(f"Telegraph 上传失败: {result}")
+
+
+class TelegramFileBackend(UploadBackend):
+    """把文件作为文档发送到指定会话，使用 Telegram 的文件下载地址"""
+
+    name = 'telegram'
+    host = 'api.telegram.org'
+    idempotent = False
+    API_BASE = 'https://api.telegram.org'
+
+    def __init__(self, http_client: HttpClient, bot_token: str, chat_id: str,
+                 semaphore: Optional[asyncio.Semaphore] = None):
+        super().__init__(semaphore)
+        self.http_client = http_client
+        self.bot_token = bot_token
+        self.chat_id = chat_id
+
+    async def upload(self, media: Media, mime: str, filename: str) -> UploadResult:
+        session = self.http_client.session
+        form = aiohttp.FormData()
+        form.add_field('chat_id', str(self.chat_id))
+        with _open_media(media) as payload:
+            form.add_field('document', payload, filename=filename, content_type=mime)
+            async with session.post(f'{self.API_BASE}/bot{self.bot_token}/sendDocument', data=form) as response:
+                if response.status >= 500:
+                    raise TransientError(f"上传到 Telegram 失败，状态码: {response.status}")
+                result = await response.json(content_type=None)
+        if result.get('error_code') == 429:
+            retry_after = float(result.get('parameters', {}).get('retry_after', 1))
+            raise RetryAfterError(f"Telegram 限流，{retry_after} 秒后重试", retry_after)
+        if not result.get('ok'):
+            error = TransientError if result.get('error_code', 0) >= 500 else UploadError
+            raise error(f"上传到 Telegram 失败: {result}")
+
+        file_id = result['result']['document']['file_id']
+        async with session.get(f'{self.API_BASE}/bot{self.bot_token}/getFile',
+                               params={'file_id': file_id}) as response:
+            result = await response.json(content_type=None)
+        if not result.get('ok'):
+            raise UploadError(f"获取 Telegram 文件路径失败: {result}")
+        file_path = result['result']['file_path']
+        return UploadResult(f'{self.API_BASE}/file/bot{self.bot_token}/{file_path}', file_id)
+
+
+class WechatBackend(UploadBackend):
+    """微信公众号永久图片素材"""
+
+    name = 'wechat'
+    host = 'api.weixin.qq.com'
+    idempotent = False
+
+    def __init__(self, http_client: HttpClient, token: str, appid: str, token_manager,
+                 semaphore: Optional[asyncio.Semaphore] = None):
+        super().__init__(semaphore)
+        self.http_client = http_client
+        self.token = token
+        self.appid = appid
+        self.token_manager = token_manager
+
+    async def upload(self, media: Media, mime: str, filename: str) -> UploadResult:
+        wechat = AsyncWechat(self.token, self.appid, self.http_client.session, self.token_manager)
+        if isinstance(media, (bytes, bytearray)):
+            try:
+                media_id, url = await wechat.upload_media_stream(media, filename, content_type=mime)
+            except WechatTokenExpiredError:
+                # token 失效时素材未创建，刷新后用内存中的内容重新上传一次
+                media_id, url = await wechat.upload_media_stream(media, filename, content_type=mime)
+        else:
+            media_id, url = await wechat.upload_media(media, mediaType='image')
+        return UploadResult(url, media_id)
+
+
+class Publisher:
+    """
+    媒体发布引擎
+    各上传目标实现相同的 upload 接口，统一处理重试、退避、熔断和统计；
+    同一个媒体可以并发发布到多个目标
+    """
+
+    def __init__(self, backends: Iterable[UploadBackend], retries: int = 2, backoff: float = 1.0,
+                 max_backoff: float = 30.0, breakers: Optional[CircuitBreakerRegistry] = None):
+        """
+        :param backends: 上传目标
+        :param retries: 失败后的重试次数
+        :param backoff: 退避基数（秒），第 n 次重试最多等待 backoff * 2^n
+        :param max_backoff: 单次等待的上限，上游要求的 Retry-After 超过该值时直接失败
+        :param breakers: 按主机共享的熔断器，为空时不熔断
+        """
+        self.backends: Dict[str, UploadBackend] = {backend.name: backend for backend in backends}
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.breakers = breakers
+        self._stats: Dict[str, UploadStats] = {name: UploadStats() for name in self.backends}
+
+    async def upload(self, destination: str, media: Media, mime: str,
+                     filename: Optional[str] = None) -> UploadResult:
+        """
+        上传到单个目标，上游故障时按带抖动的指数退避重试，全部失败后抛出最后一次的异常
+        业务错误和本地文件错误不重试；非幂等的目标只在连接未建立或被限流拒绝时重试
+        目标主机熔断时直接抛出 CircuitOpenError
+        """
+        backend = self.backends[destination]
+        stats = self._stats[destination]
+        filename = _filename(media, mime, filename)
+        breaker = self.breakers.get(backend.host) if self.breakers is not None else None
+
+        async def attempt() -> UploadResult:
+            stats.attempts += 1
+            started = time.monotonic()
+            try:
+                async with backend.semaphore or contextlib.nullcontext():
+                    result = await backend.upload(media, mime, filename)
+            except Exception:
+                stats.failures += 1
+                raise
+            finally:
+                stats.seconds += time.monotonic() - started
+            stats.successes += 1
+            stats.bytes += _media_size(media)
+            return result
+
+        try:
+            result = await call_with_retry(
+                attempt,
+                retries=self.retries,
+                base_delay=self.backoff,
+                max_delay=self.max_backoff,
+                breaker=breaker,
+                retry_on=TRANSIENT_ERRORS if backend.idempotent else CONNECT_ERRORS,
+                description=f"上传到 {destination}"
+            )
+        except CircuitOpenError:
+            stats.rejected += 1
+            raise
+        logger.info(f"上传到 {destination} 成功: {result.url}")
+        return result
+
+    async def publish(self, media: Media, mime: str, destinations: Iterable[str],
+                      filename: Optional[str] = None) -> Dict[str, Union[UploadResult, Exception]]:
+        """并发上传到多个目标，返回每个目标的结果或异常"""
+        destinations = list(destinations)
+        results = await asyncio.gather(
+            *(self.upload(destination, media, mime, filename) for destination in destinations),
+            return_exceptions=True
+        )
+        return dict(zip(destinations, results))
+
+    def metrics(self) -> Dict[str, dict]:
+        """各上传目标的累计统计"""
+        return {name: asdict(stats) for name, stats in self._stats.items()}
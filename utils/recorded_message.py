@@ -0,0 +1,79 @@
+from dataclasses import dataclass, field, fields
+from typing import List, Optional
+
+
+@dataclass(slots=True)
+class RecordedMessage:
+    """
+    记录的单条消息
+    content 保存原始内容（文本或 Telegram 文件 URL），各发布目标解析后的地址分别保存，
+    渲染时无需为 Telegraph 和微信各复制一份消息列表
+    """
+
+    time: str
+    type: str = 'text'
+    content: str = ''
+    caption: Optional[str] = None
+    filename: Optional[str] = None
+    forward_from: Optional[str] = None
+    forward_date: Optional[str] = None
+    file_unique_id: Optional[str] = None
+
+    # 相册（type='album'）中的图片，每张图片也是一条 RecordedMessage
+    media_group_id: Optional[str] = None
+    items: List['RecordedMessage'] = field(default_factory=list)
+
+    # 第一个贴纸的封面
+    is_first: bool = False
+    cover_path: Optional[str] = None
+
+    # Telegraph 目标
+    telegraph_url: Optional[str] = None
+
+    # 微信目标
+    wechat_url: Optional[str] = None
+    wechat_failed: bool = False
+    local_path: Optional[str] = None
+    local_temp: bool = False
+
+    @property
+    def telegraph_src(self) -> str:
+        return self.telegraph_url or self.content
+
+    @property
+    def wechat_src(self) -> str:
+        return self.wechat_url or self.content
+
+    @property
+    def photos(self) -> List['RecordedMessage']:
+        """消息包含的图片，相册返回其中的每张图片"""
+        if self.type == 'album':
+            return [item for item in self.items if item.type == 'photo']
+        if self.type == 'photo':
+            return [self]
+        return []
+
+    @property
+    def is_gif(self) -> bool:
+        if self.type != 'photo':
+            return False
+        if self.wechat_url and 'wx_fmt=gif' in self.wechat_url:
+            return True
+        return any(path and path.endswith('.gif') for path in (self.content, self.local_path))
+
+    def to_dict(self) -> dict:
+        """序列化为字典，省略空字段"""
+        data = {}
+        for f in fields(self):
+            value = getattr(self, f.name)
+            if f.name == 'items':
+                if value:
+                    data['items'] = [item.to_dict() for item in value]
+            elif value is not None and value is not False:
+                data[f.name] = value
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'RecordedMessage':
+        items = [cls.from_dict(item) for item in data.get('items', [])]
+        return cls(**{**data, 'items': items})
@@ -0,0 +1,173 @@
+import asyncio
+import logging
+import random
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Dict, Optional, Tuple, Type, TypeVar
+
+import aiohttp
+import requests
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+
+class CircuitOpenError(Exception):
+    """熔断器打开期间直接失败，不再请求上游"""
+
+
+class RetryAfterError(Exception):
+    """上游要求稍后重试（HTTP 429 / Retry-After）"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TransientError(Exception):
+    """上游暂时不可用（5xx、系统繁忙），稍后重试可能成功"""
+
+
+class DownloadError(Exception):
+    """下载源文件时的暂时性错误，可以重试，但不计入上传目标的熔断"""
+
+
+# 上游故障：可以重试，并计入熔断器的失败次数；业务错误和本地错误重试也会同样失败，不在其中
+TRANSIENT_ERRORS: Tuple[Type[BaseException], ...] = (
+    TransientError, RetryAfterError, asyncio.TimeoutError,
+    aiohttp.ClientConnectionError, requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+)
+
+# 请求未被上游处理的错误：连接未建立或被限流拒绝，非幂等的接口只在这些错误时重试
+CONNECT_ERRORS: Tuple[Type[BaseException], ...] = (
+    RetryAfterError, aiohttp.ClientConnectorError, requests.exceptions.ConnectionError,
+)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """解析 Retry-After 头，支持秒数和 HTTP 日期两种格式"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """全抖动指数退避：在 [0, min(cap, base * 2^attempt)] 中均匀取值，避免大量请求同时重试"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class CircuitBreaker:
+    """
+    单个上游主机的熔断器
+    连续失败达到阈值后打开，期间调用直接失败；
+    超过 reset_timeout 后放行一次试探请求，成功则关闭，失败则重新打开
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+
+    def before_call(self) -> None:
+        """请求前检查，熔断期间抛出 CircuitOpenError"""
+        if self.state == self.CLOSED:
+            return
+        now = time.monotonic()
+        if now - self._opened_at >= self.reset_timeout:
+            # 每个 reset_timeout 周期只放行一次试探请求，试探请求被取消时下个周期再放行
+            logger.info(f"熔断器 {self.name} 进入半开状态，放行试探请求")
+            self.state = self.HALF_OPEN
+            self._opened_at = now
+            return
+        raise CircuitOpenError(f"{self.name} 熔断中，暂停请求")
+
+    def record_success(self) -> None:
+        if self.state != self.CLOSED:
+            logger.info(f"熔断器 {self.name} 已恢复")
+        self.state = self.CLOSED
+        self._failures = 0
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logger.warning(f"熔断器 {self.name} 打开，连续失败 {self._failures} 次")
+            self.state = self.OPEN
+            self._opened_at = time.monotonic()
+
+
+class CircuitBreakerRegistry:
+    """按主机名管理熔断器，同一主机的所有调用共享一个熔断器"""
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._breakers: Dict[str, CircuitBreaker] = {}
+
+    def get(self, host: str) -> CircuitBreaker:
+        breaker = self._breakers.get(host)
+        if breaker is None:
+            breaker = CircuitBreaker(host, self.failure_threshold, self.reset_timeout)
+            self._breakers[host] = breaker
+        return breaker
+
+    def states(self) -> Dict[str, str]:
+        return {host: breaker.state for host, breaker in self._breakers.items()}
+
+
+async def call_with_retry(func: Callable[[], Awaitable[T]], *, retries: int, base_delay: float,
+                          max_delay: float, breaker: Optional[CircuitBreaker] = None,
+                          retry_on: Tuple[Type[BaseException], ...] = TRANSIENT_ERRORS,
+                          description: str = '') -> T:
+    """
+    调用 func，失败时按全抖动指数退避重试
+    上游返回 Retry-After 时按其要求等待，要求的时间超过 max_delay 时直接失败，不占用协程排队；
+    熔断器打开时立即失败，不计入重试；只有 TRANSIENT_ERRORS 计入熔断器的失败次数
+    :param retry_on: 允许重试的异常类型，其他异常直接抛出；非幂等的接口应使用 CONNECT_ERRORS
+    """
+    for attempt in range(retries + 1):
+        if breaker is not None:
+            breaker.before_call()
+        try:
+            result = await func()
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            if breaker is not None and isinstance(e, TRANSIENT_ERRORS):
+                breaker.record_failure()
+            if attempt == retries or not isinstance(e, retry_on):
+                raise
+            if breaker is not None and breaker.state == CircuitBreaker.OPEN:
+                # 本次失败使熔断器打开，后续重试必然被拒绝，直接抛出原始异常
+                raise
+            if isinstance(e, RetryAfterError):
+                if e.retry_after > max_delay:
+                    raise
+                delay = e.retry_after
+            else:
+                delay = backoff_delay(attempt, base_delay, max_delay)
+            logger.warning(f"{description} 第{attempt + 1}次失败，{delay:.1f} 秒后重试: {str(e)}")
+            await asyncio.sleep(delay)
+        else:
+            if breaker is not None:
+                breaker.record_success()
+            return result
@@ -0,0 +1,211 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional
+
+from utils.recorded_message import RecordedMessage
+
+logger = logging.getLogger(__name__)
+
+
+class SessionStore(ABC):
+    """
+    记录会话的存储接口
+    内存中只保留每个会话的消息数量，消息内容由具体实现保存
+    消息到达时先按序号预留位置，处理完成后再写入内容，读取时按序号排序，
+    并发处理的消息即使完成顺序不同也能保持原始顺序
+    """
+
+    def __init__(self):
+        self._counts: Dict[int, int] = {}
+
+    def is_open(self, chat_id: int) -> bool:
+        return chat_id in self._counts
+
+    def count(self, chat_id: int) -> int:
+        return self._counts.get(chat_id, 0)
+
+    @abstractmethod
+    def open(self, chat_id: int) -> None:
+        """开始新的记录，丢弃该会话之前的消息"""
+
+    @abstractmethod
+    def reserve(self, chat_id: int, seq: int) -> int:
+        """按序号（Telegram message_id）预留一条消息的位置，返回消息 ID"""
+
+    @abstractmethod
+    def update(self, message_id: int, message: RecordedMessage) -> None:
+        """写入预留位置的消息内容，或更新后台处理后的消息内容"""
+
+    @abstractmethod
+    def discard(self, chat_id: int, message_id: int) -> None:
+        """删除未写入内容的预留位置"""
+
+    @abstractmethod
+    def load(self, chat_id: int) -> List[RecordedMessage]:
+        """按序号读取会话中已写入内容的全部消息"""
+
+    @abstractmethod
+    def close(self, chat_id: int) -> None:
+        """结束记录并删除会话数据"""
+
+    def shutdown(self) -> None:
+        pass
+
+
+class MemorySessionStore(SessionStore):
+    """进程内存储，重启后数据丢失"""
+
+    def __init__(self):
+        super().__init__()
+        self._messages: Dict[int, Optional[RecordedMessage]] = {}
+        self._seqs: Dict[int, int] = {}
+        self._sessions: Dict[int, List[int]] = {}
+        self._next_id = 1
+
+    def open(self, chat_id: int) -> None:
+        self.close(chat_id)
+        self._sessions[chat_id] = []
+        self._counts[chat_id] = 0
+
+    def reserve(self, chat_id: int, seq: int) -> int:
+        message_id = self._next_id
+        self._next_id += 1
+        self._messages[message_id] = None
+        self._seqs[message_id] = seq
+        self._sessions[chat_id].append(message_id)
+        self._counts[chat_id] += 1
+        return message_id
+
+    def update(self, message_id: int, message: RecordedMessage) -> None:
+        if message_id in self._messages:
+            self._messages[message_id] = message
+
+    def discard(self, chat_id: int, message_id: int) -> None:
+        if message_id in self._messages and self._messages[message_id] is None:
+            del self._messages[message_id]
+            del self._seqs[message_id]
+            self._sessions[chat_id].remove(message_id)
+            self._counts[chat_id] -= 1
+
+    def load(self, chat_id: int) -> List[RecordedMessage]:
+        message_ids = sorted(self._sessions.get(chat_id, []), key=lambda message_id: (self._seqs[message_id], message_id))
+        return [self._messages[message_id] for message_id in message_ids if self._messages[message_id] is not None]
+
+    def close(self, chat_id: int) -> None:
+        for message_id in self._sessions.pop(chat_id, []):
+            self._messages.pop(message_id, None)
+            self._seqs.pop(message_id, None)
+        self._counts.pop(chat_id, None)
+
+
+class SqliteSessionStore(SessionStore):
+    """
+    基于 SQLite (WAL) 的持久化存储
+    每条消息到达时立即写入，重启后自动恢复未结束的会话
+    """
+
+    def __init__(self, db_path: str):
+        super().__init__()
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                chat_id INTEGER PRIMARY KEY,
+                started_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                chat_id INTEGER NOT NULL,
+                seq INTEGER NOT NULL,
+                filled INTEGER NOT NULL DEFAULT 0,
+                data TEXT NOT NULL
+            )
+        """)
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_messages_chat ON messages(chat_id, seq, id)')
+        # 重启前未处理完成的预留位置不会再被写入
+        self._conn.execute('DELETE FROM messages WHERE filled = 0')
+        self._conn.commit()
+
+        # 恢复未结束的会话索引
+        rows = self._conn.execute("""
+            SELECT s.chat_id, COUNT(m.id) FROM sessions s
+            LEFT JOIN messages m ON m.chat_id = s.chat_id
+            GROUP BY s.chat_id
+        """).fetchall()
+        for chat_id, count in rows:
+            self._counts[chat_id] = count
+        if rows:
+            logger.info(f"恢复未结束的记录会话: {len(rows)} 个")
+
+    def open(self, chat_id: int) -> None:
+        with self._lock:
+            self._conn.execute('DELETE FROM messages WHERE chat_id = ?', (chat_id,))
+            self._conn.execute(
+                'INSERT OR REPLACE INTO sessions (chat_id, started_at) VALUES (?, ?)',
+                (chat_id, time.time())
+            )
+            self._conn.commit()
+        self._counts[chat_id] = 0
+
+    def reserve(self, chat_id: int, seq: int) -> int:
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO messages (chat_id, seq, data, filled) VALUES (?, ?, '{}', 0)",
+                (chat_id, seq)
+            )
+            self._conn.commit()
+        self._counts[chat_id] = self._counts.get(chat_id, 0) + 1
+        return cursor.lastrowid
+
+    def update(self, message_id: int, message: RecordedMessage) -> None:
+        with self._lock:
+            self._conn.execute(
+                'UPDATE messages SET data = ?, filled = 1 WHERE id = ?',
+                (json.dumps(message.to_dict(), ensure_ascii=False), message_id)
+            )
+            self._conn.commit()
+
+    def discard(self, chat_id: int, message_id: int) -> None:
+        with self._lock:
+            cursor = self._conn.execute('DELETE FROM messages WHERE id = ? AND filled = 0', (message_id,))
+            self._conn.commit()
+        if cursor.rowcount:
+            self._counts[chat_id] -= 1
+
+    def load(self, chat_id: int) -> List[RecordedMessage]:
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT data FROM messages WHERE chat_id = ? AND filled = 1 ORDER BY seq, id',
+                (chat_id,)
+            ).fetchall()
+        return [RecordedMessage.from_dict(json.loads(row[0])) for row in rows]
+
+    def close(self, chat_id: int) -> None:
+        with self._lock:
+            self._conn.execute('DELETE FROM messages WHERE chat_id = ?', (chat_id,))
+            self._conn.execute('DELETE FROM sessions WHERE chat_id = ?', (chat_id,))
+            self._conn.commit()
+        self._counts.pop(chat_id, None)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def create_session_store(backend: str, db_path: str) -> SessionStore:
+    """根据配置创建会话存储"""
+    if backend == 'memory':
+        return MemorySessionStore()
+    if backend == 'sqlite':
+        return SqliteSessionStore(db_path)
+    raise ValueError(f"未知的会话存储类型: {backend}")
@@ -0,0 +1,401 @@
+import asyncio
+import logging
+import os
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 超出体积预算时逐级降低的编码参数：(宽度比例, 帧率比例, 调色板颜色数)
+QUALITY_LADDER = (
+    (1.0, 1.0, 256),
+    (1.0, 1.0, 128),
+    (1.0, 0.8, 128),
+    (0.8, 0.8, 128),
+    (0.8, 0.6, 64),
+    (0.6, 0.6, 64),
+    (0.5, 0.5, 32),
+)
+
+
+class StickerBusyError(Exception):
+    """转码队列已满，拒绝新的任务"""
+
+
+# 以下函数在子进程中执行，必须定义在模块顶层以便序列化
+
+def _target_size(width: int, height: int, max_width: int) -> Tuple[int, int]:
+    new_width = min(width, max_width)
+    new_height = max(1, int(round(height * (new_width / width))))
+    return new_width, new_height
+
+
+def _flatten(rgba):
+    """把带透明通道的帧合成到白色背景上"""
+    import numpy
+
+    if rgba.shape[2] == 3:
+        return rgba
+    alpha = rgba[..., 3:4].astype(numpy.float32) / 255.0
+    rgb = rgba[..., :3].astype(numpy.float32)
+    return (rgb * alpha + 255.0 * (1.0 - alpha)).astype(numpy.uint8)
+
+
+def _resize_batch(frames, width: int, height: int):
+    """
+    对一批帧做双线性缩放，frames 形状为 (N, H, W, C)
+    所有帧共用同一组采样坐标和权重，一次完成整批计算
+    """
+    import numpy
+
+    src_h, src_w = frames.shape[1:3]
+    if (src_w, src_h) == (width, height):
+        return frames
+
+    ys = numpy.clip((numpy.arange(height) + 0.5) * src_h / height - 0.5, 0, src_h - 1)
+    xs = numpy.clip((numpy.arange(width) + 0.5) * src_w / width - 0.5, 0, src_w - 1)
+    y0 = numpy.floor(ys).astype(numpy.int64)
+    x0 = numpy.floor(xs).astype(numpy.int64)
+    y1 = numpy.minimum(y0 + 1, src_h - 1)
+    x1 = numpy.minimum(x0 + 1, src_w - 1)
+    wy = (ys - y0)[None, :, None, None].astype(numpy.float32)
+    wx = (xs - x0)[None, None, :, None].astype(numpy.float32)
+
+    data = frames.astype(numpy.float32)
+    top = data[:, y0][:, :, x0] * (1 - wx) + data[:, y0][:, :, x1] * wx
+    bottom = data[:, y1][:, :, x0] * (1 - wx) + data[:, y1][:, :, x1] * wx
+    return (top * (1 - wy) + bottom * wy + 0.5).astype(numpy.uint8)
+
+
+def _decode_tgs(tgs_path: str, max_width: int, fps: float, max_frames: int, frames_path: Optional[str] = None):
+    """
+    按目标帧率取样，并直接以目标尺寸光栅化 TGS 动画
+    指定 frames_path 时优先读取已渲染的帧集合，未命中或文件损坏时重新渲染，
+    结果先写入唯一的临时文件再原子替换到 frames_path，并发渲染同一贴纸不会写出交错的文件
+    """
+    import io
+    import cairosvg
+    import numpy
+    from PIL import Image
+    from lottie import parsers
+    from lottie.exporters.svg import export_svg
+
+    if frames_path and os.path.exists(frames_path):
+        try:
+            with numpy.load(frames_path) as data:
+                return list(data['frames']), float(data['fps'])
+        except Exception as e:
+            # 缓存文件截断或损坏，重新渲染并覆盖
+            logger.warning(f"TGS 渲染帧缓存损坏，重新渲染: {frames_path}: {str(e)}")
+
+    animation = parsers.tgs.parse_tgs(tgs_path)
+    width, height = _target_size(animation.width, animation.height, max_width)
+    src_fps = animation.frame_rate
+    out_fps = min(fps, src_fps)
+
+    frames = []
+    step = src_fps / out_fps
+    frame = float(animation.in_point)
+    while frame < animation.out_point and len(frames) < max_frames:
+        svg = io.BytesIO()
+        export_svg(animation, svg, int(frame))
+        svg.seek(0)
+        png = cairosvg.svg2png(file_obj=svg, output_width=width, output_height=height)
+        frames.append(_flatten(numpy.array(Image.open(io.BytesIO(png)).convert('RGBA'))))
+        frame += step
+
+    if frames_path and frames:
+        tmp_path = f"{frames_path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                numpy.savez_compressed(f, frames=numpy.stack(frames), fps=out_fps)
+            os.replace(tmp_path, frames_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+    return frames, out_fps
+
+
+def _iter_decimated(reader: Iterable, src_fps: float, fps: float, max_frames: int) -> Iterator:
+    """逐帧读取，只放行时间戳到达下一个输出时刻的帧，最多输出 max_frames 帧后停止解码"""
+    count = 0
+    next_time = 0.0
+    for idx, frame in enumerate(reader):
+        if count >= max_frames:
+            break
+        if idx / src_fps + 1e-6 < next_time:
+            continue
+        yield frame[..., :4]
+        count += 1
+        next_time += 1.0 / fps
+
+
+def _iter_resized(frames: Iterator, max_width: int, batch_size: int = 8) -> Iterator:
+    """把原始尺寸的帧按小批量缩放到目标尺寸，同一时间只保留一个批次的原始帧"""
+    batch = []
+    for frame in frames:
+        batch.append(frame)
+        if len(batch) == batch_size:
+            yield from _flush_batch(batch, max_width)
+            batch = []
+    if batch:
+        yield from _flush_batch(batch, max_width)
+
+
+def _flush_batch(batch: List, max_width: int) -> Iterator:
+    import numpy
+
+    stacked = numpy.stack(batch)
+    width, height = _target_size(stacked.shape[2], stacked.shape[1], max_width)
+    for frame in _resize_batch(stacked, width, height):
+        yield _flatten(frame)
+
+
+def _decode_webm(webm_path: str, max_width: int, fps: float, max_frames: int):
+    """
+    流式解码：读取 → 抽帧 → 缩放，逐级传递
+    内存中只保留缩放后的目标帧和一个批次的原始帧，与贴纸时长无关
+    """
+    import imageio
+
+    reader = imageio.get_reader(webm_path)
+    try:
+        src_fps = reader.get_meta_data()['fps']
+        out_fps = min(fps, src_fps)
+        frames = list(_iter_resized(_iter_decimated(reader, src_fps, out_fps, max_frames), max_width))
+    finally:
+        reader.close()
+    return frames, out_fps
+
+
+def _decimate(frames: List, src_fps: float, fps: float) -> List:
+    """按时间戳从已解码的帧中抽取目标帧率的帧"""
+    if fps >= src_fps:
+        return frames
+    count = max(1, int(len(frames) * fps / src_fps))
+    return [frames[min(len(frames) - 1, int(round(idx * src_fps / fps)))] for idx in range(count)]
+
+
+def _encode_gif(frames: List, fp, fps: float, colors: int = 256) -> None:
+    """使用所有帧共享的全局调色板编码 GIF"""
+    import numpy
+    from PIL import Image
+
+    # 从均匀取样的帧中生成一个全局调色板
+    sample_step = max(1, len(frames) // 16)
+    sample = numpy.concatenate(frames[::sample_step], axis=0)
+    palette = Image.fromarray(sample).quantize(colors=colors, method=Image.Quantize.MEDIANCUT)
+
+    images = [Image.fromarray(frame).quantize(palette=palette, dither=Image.Dither.NONE) for frame in frames]
+    images[0].save(
+        fp,
+        format='GIF',
+        save_all=True,
+        append_images=images[1:],
+        duration=int(round(1000 / fps)),
+        loop=0,
+        optimize=False,
+        disposal=1
+    )
+
+
+def _transcode(src_path: str, kind: str, gif_path: str, png_path: Optional[str],
+               max_width: int, fps: float, max_bytes: Optional[int] = None,
+               start_step: int = 0, max_frames: int = 100,
+               frames_path: Optional[str] = None) -> Tuple[str, Optional[str], int]:
+    """
+    单次转码：按目标尺寸和帧率解码后直接编码为 GIF，可选导出第一帧作为 PNG 封面
+    指定 max_bytes 时从 start_step 开始沿 QUALITY_LADDER 降级，直到结果不超过体积预算
+    frames_path 为 TGS 渲染帧的缓存文件
+    :return: (GIF 路径, PNG 封面路径, 实际使用的降级档位)
+    """
+    import io
+    import numpy
+    from PIL import Image
+
+    if kind == 'tgs':
+        frames, out_fps = _decode_tgs(src_path, max_width, fps, max_frames, frames_path)
+    elif kind == 'webm':
+        frames, out_fps = _decode_webm(src_path, max_width, fps, max_frames)
+    else:
+        raise ValueError(f"未知的贴纸类型: {kind}")
+    if not frames:
+        raise ValueError(f"贴纸没有可用的帧: {src_path}")
+
+    if png_path:
+        Image.fromarray(frames[0]).save(png_path, 'PNG')
+
+    # 只解码一次，各档位在已解码的帧上缩放和抽帧
+    height, width = frames[0].shape[:2]
+    steps = range(start_step, len(QUALITY_LADDER)) if max_bytes else [start_step]
+    for step in steps:
+        width_scale, fps_scale, colors = QUALITY_LADDER[step]
+        step_fps = max(1.0, out_fps * fps_scale)
+        step_frames = _decimate(frames, out_fps, step_fps)
+        if width_scale < 1.0:
+            step_width, step_height = _target_size(width, height, max(1, int(width * width_scale)))
+            step_frames = list(_resize_batch(numpy.stack(step_frames), step_width, step_height))
+
+        buffer = io.BytesIO()
+        _encode_gif(step_frames, buffer, step_fps, colors)
+        if not max_bytes or buffer.tell() <= max_bytes:
+            break
+    else:
+        logger.warning(f"贴纸在最低档位仍超出体积预算: {buffer.tell()} > {max_bytes}")
+
+    with open(gif_path, 'wb') as f:
+        f.write(buffer.getbuffer())
+    return gif_path, png_path, step
+
+
+def _convert_static(data: bytes) -> Tuple[bytes, str]:
+    """
+    转换静态贴纸（WebP）：带透明通道的合成到白色背景后输出 PNG，否则输出 JPEG
+    :return: (图片内容, MIME 类型)
+    """
+    import io
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as img:
+        has_alpha = img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info)
+        buffer = io.BytesIO()
+        if has_alpha:
+            rgba = img.convert('RGBA')
+            bg = Image.new('RGB', rgba.size, (255, 255, 255))
+            bg.paste(rgba, mask=rgba.getchannel('A'))
+            bg.save(buffer, 'PNG', optimize=True)
+            return buffer.getvalue(), 'image/png'
+        img.convert('RGB').save(buffer, 'JPEG', quality=90, optimize=True)
+        return buffer.getvalue(), 'image/jpeg'
+
+
+class StickerConverter:
+    """
+    贴纸转码引擎
+    CPU 密集的渲染在独立进程池中执行，避免阻塞事件循环
+    """
+
+    def __init__(self, max_workers: int, max_pending: int, timeout: float, max_bytes: Optional[int] = None,
+                 max_frames: int = 100, render_cache=None):
+        """
+        :param max_workers: 进程池大小
+        :param max_pending: 除正在执行的任务外，允许排队等待的任务数
+        :param timeout: 单个任务的超时时间（秒）
+        :param max_bytes: 输出 GIF 的体积预算，为空时不限制
+        :param max_frames: 单个贴纸最多解码的帧数
+        :param render_cache: 保存 TGS 渲染帧的 MediaCache，为空时不缓存
+        """
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self.max_frames = max_frames
+        self.render_cache = render_cache
+        self._executor = None
+        self.capacity = max_workers + max_pending
+        # 已提交到进程池、尚未真正结束的任务数（超时的任务在子进程结束前仍然占用名额）
+        self._inflight = 0
+        # 每个贴纸包上次满足预算的档位，同一包的贴纸复杂度相近，从该档位开始可以少做几次编码
+        self._set_steps: Dict[str, int] = {}
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._executor
+
+    def _reset_executor(self, executor: ProcessPoolExecutor) -> None:
+        """子进程异常退出后进程池不可再用，丢弃后由下一个任务重新创建"""
+        if self._executor is executor:
+            logger.error("贴纸转码进程池已损坏，重新创建")
+            executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def _release(self, future) -> None:
+        self._inflight -= 1
+        if not future.cancelled():
+            # 取出超时任务的异常，避免未处理异常的警告
+            future.exception()
+
+    async def _run(self, func, *args):
+        """
+        提交任务到进程池，正在执行和排队的任务达到上限时立即抛出 StickerBusyError
+        超时只让调用方放弃等待，名额保留到子进程真正完成，保证进程池的积压有上限
+        """
+        if self._inflight >= self.capacity:
+            raise StickerBusyError(f"贴纸转码队列已满（{self.capacity}），拒绝任务: {args[0]}")
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        try:
+            future = loop.run_in_executor(executor, func, *args)
+        except BrokenProcessPool:
+            # 之前的任务已经让进程池损坏，换一个新的进程池提交
+            self._reset_executor(executor)
+            executor = self._get_executor()
+            future = loop.run_in_executor(executor, func, *args)
+        self._inflight += 1
+        future.add_done_callback(self._release)
+        try:
+            # shield 防止超时时取消 future，否则名额会在子进程仍在运行时被提前释放
+            return await asyncio.wait_for(asyncio.shield(future), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"贴纸转码超时: {func.__name__} {args[0]}")
+            raise
+        except BrokenProcessPool:
+            # 子进程被杀死（OOM、渲染库崩溃），本任务失败，后续任务使用新的进程池
+            self._reset_executor(executor)
+            raise
+
+    async def transcode(self, src_path: str, kind: str, gif_path: str, png_path: Optional[str] = None,
+                        max_width: int = 320, fps: float = 10,
+                        set_name: Optional[str] = None,
+                        file_unique_id: Optional[str] = None) -> Tuple[str, Optional[str]]:
+        """
+        把 TGS（kind='tgs'）或 WebM（kind='webm'）贴纸直接转码为目标尺寸和帧率的 GIF
+        超出体积预算时自动降低尺寸、帧率和颜色数，并按贴纸包记住满足预算的档位
+        TGS 的渲染帧按 file_unique_id 缓存，同一贴纸只光栅化一次
+        :return: (GIF 路径, PNG 封面路径)
+        """
+        # 从贴纸包上次档位的上一级开始，较轻的贴纸可以逐步回到更高画质，单个复杂贴纸不会让整个包永久降级
+        start_step = max(0, self._set_steps.get(set_name, 0) - 1) if set_name else 0
+
+        frames_key, frames_path, frames_cached = None, None, False
+        if kind == 'tgs' and file_unique_id and self.render_cache is not None:
+            frames_key = f"{file_unique_id}_frames_{max_width}_{fps:g}"
+            cached = self.render_cache.get(frames_key)
+            if cached and cached.get('path'):
+                frames_path, frames_cached = cached['path'], True
+                logger.info(f"TGS 渲染帧命中缓存: {frames_key}")
+            else:
+                # 每次渲染写入自己的文件，完成后再移动到缓存目录
+                frames_path = os.path.join(os.path.dirname(gif_path) or '.', f"{frames_key}_{uuid.uuid4().hex}.npz")
+
+        try:
+            gif_path, png_path, step = await self._run(
+                _transcode, src_path, kind, gif_path, png_path, max_width, fps,
+                self.max_bytes, start_step, self.max_frames, frames_path
+            )
+        except Exception:
+            if frames_key and not frames_cached and os.path.exists(frames_path):
+                os.unlink(frames_path)
+            raise
+        if frames_key and not frames_cached and os.path.exists(frames_path):
+            self.render_cache.store_file(frames_key, frames_path)
+        if set_name:
+            self._set_steps[set_name] = step
+        if step:
+            logger.info(f"贴纸按体积预算降级到档位 {step}: {QUALITY_LADDER[step]}")
+        return gif_path, png_path
+
+    async def convert_static(self, data: bytes) -> Tuple[bytes, str]:
+        """
+        在线程池中转换静态贴纸，输入输出都在内存中
+        :return: (图片内容, MIME 类型)
+        """
+        return await asyncio.to_thread(_convert_static, data)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -2,13 +2,21 @@ import aiohttp
 from bs4 import BeautifulSoup
 import os
 import asyncio
-from typing import Tuple, List
+from typing import Tuple, List, Optional
+
+from utils.http_client import HttpClient
 
 class TelegraphHandler:
-    def __init__(self):
+    def __init__(self, http_client: Optional[HttpClient] = None):
+        """
+        :param http_client: 共享的 HTTP 客户端，未提供时自行创建会话
+        """
+        self.http_client = http_client
         self.session = None
     
     async def get_session(self):
+        if self.http_client is not None:
+            return self.http_client.session
         if self.session is None:
             self.session = aiohttp.ClientSession()
         return self.session
@@ -0,0 +1,64 @@
+from typing import List, Union
+
+Node = Union[str, dict]
+
+
+def tag(name: str, *children: Node, **attrs) -> dict:
+    """构造 Telegraph 节点"""
+    node = {'tag': name}
+    if attrs:
+        node['attrs'] = attrs
+    if children:
+        node['children'] = list(children)
+    return node
+
+
+class TelegraphNodeBuilder:
+    """
+    把记录的消息直接转换为 Telegraph 的 content 节点列表
+    Telegraph 文章的唯一来源，省去渲染 HTML 再由 Telegraph 解析的往返
+    """
+
+    title = '消息记录'
+
+    def header(self) -> List[Node]:
+        return [tag('h3', self.title)]
+
+    def message_nodes(self, msg) -> List[Node]:
+        """单条消息对应的节点"""
+        nodes = [tag('p', tag('b', '时间:'), f" {msg.time}", tag('br'), tag('b', '类型:'), f" {msg.type}")]
+
+        if msg.forward_from:
+            nodes.append(tag('p', tag('i', f"转发自: {msg.forward_from} 于 {msg.forward_date}")))
+
+        if msg.type == 'text':
+            nodes.append(tag('p', msg.content))
+        elif msg.type == 'photo':
+            nodes.append(tag('img', src=msg.telegraph_src))
+            if msg.caption:
+                nodes.append(tag('p', tag('i', msg.caption)))
+        elif msg.type == 'album':
+            for item in msg.items:
+                children = [tag('img', src=item.telegraph_src)]
+                if item.caption:
+                    children.append(tag('figcaption', item.caption))
+                nodes.append(tag('figure', *children))
+        elif msg.type == 'video':
+            nodes.append(tag('p', tag('a', '查看视频', href=msg.content)))
+        elif msg.type == 'document':
+            nodes.append(tag('p', tag('a', msg.filename or '下载文件', href=msg.content)))
+        elif msg.type == 'voice':
+            nodes.append(tag('p', tag('a', '收听语音消息', href=msg.content)))
+
+        if msg.caption:
+            nodes.append(tag('p', tag('i', f"说明: {msg.caption}")))
+
+        nodes.append(tag('hr'))
+        return nodes
+
+    def build(self, messages) -> List[Node]:
+        """整篇文章的节点列表"""
+        nodes = self.header()
+        for msg in messages:
+            nodes.extend(self.message_nodes(msg))
+        return nodes
@@ -0,0 +1,170 @@
+import asyncio
+import json
+import logging
+import re
+import threading
+from typing import List, Optional
+
+from telegraph import Telegraph
+from telegraph.exceptions import TelegraphException
+
+from utils.resilience import CONNECT_ERRORS, TRANSIENT_ERRORS, CircuitBreaker, RetryAfterError, call_with_retry
+from utils.telegraph_nodes import Node, TelegraphNodeBuilder, tag
+
+logger = logging.getLogger(__name__)
+
+
+def _node_size(node: Node) -> int:
+    return len(json.dumps(node, ensure_ascii=False).encode('utf-8')) + 1
+
+
+def _flood_wait(e: TelegraphException) -> Optional[float]:
+    """Telegraph 限流时返回 FLOOD_WAIT_<秒数>"""
+    match = re.match(r'FLOOD_WAIT_(\d+)', str(e))
+    return float(match.group(1)) if match else None
+
+
+class TelegraphPublisher:
+    """
+    Telegraph 文章发布器
+    内容超过单页大小限制时按大小拆分为多页，页面之间带上一页/下一页导航，
+    页面以有限的并发创建，返回目录页链接；
+    限流（FLOOD_WAIT）和网络错误按退避重试，telegra.ph 熔断时直接失败
+    """
+
+    # Telegraph 单页 content 限制为 64KB，预留导航节点的空间
+    MAX_PAGE_BYTES = 60 * 1024
+
+    def __init__(self, telegraph: Telegraph, title: str = '消息记录', max_page_bytes: int = MAX_PAGE_BYTES,
+                 concurrency: int = 3, retries: int = 2, backoff: float = 1.0, max_backoff: float = 30.0,
+                 breaker: Optional[CircuitBreaker] = None):
+        """
+        :param telegraph: 已创建账号的 Telegraph 客户端，各线程使用同一账号的独立客户端
+        :param concurrency: 同时进行的页面请求数
+        :param retries: 失败后的重试次数
+        :param backoff: 退避基数（秒）
+        :param max_backoff: 单次等待的上限，FLOOD_WAIT 超过该值时直接失败
+        :param breaker: telegra.ph 的熔断器，为空时不熔断
+        """
+        self.telegraph = telegraph
+        self.title = title
+        self.max_page_bytes = max_page_bytes
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.breaker = breaker
+        self.builder = TelegraphNodeBuilder()
+        self._semaphore = asyncio.Semaphore(concurrency)
+        # Telegraph 客户端内部的 requests.Session 不是线程安全的，每个线程使用自己的客户端
+        self._local = threading.local()
+
+    def split(self, messages) -> List[List[Node]]:
+        """按消息边界拆分节点，单条消息不会被拆到两页"""
+        pages = []
+        current = self.builder.header()
+        size = sum(_node_size(node) for node in current)
+        has_message = False
+
+        for msg in messages:
+            nodes = self.builder.message_nodes(msg)
+            nodes_size = sum(_node_size(node) for node in nodes)
+            if has_message and size + nodes_size > self.max_page_bytes:
+                pages.append(current)
+                current, size = [], 0
+            current.extend(nodes)
+            size += nodes_size
+            has_message = True
+
+        pages.append(current)
+        return pages
+
+    def _client(self) -> Telegraph:
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = Telegraph(self.telegraph.get_access_token())
+            self._local.client = client
+        return client
+
+    def _call(self, method: str, *args, **kwargs):
+        """在线程中调用 Telegraph 接口，限流错误转换为 RetryAfterError"""
+        try:
+            return getattr(self._client(), method)(*args, **kwargs)
+        except TelegraphException as e:
+            retry_after = _flood_wait(e)
+            if retry_after is not None:
+                raise RetryAfterError(f"Telegraph 限流，{retry_after} 秒后重试", retry_after) from e
+            raise
+
+    async def _request(self, description: str, retry_on, method: str, *args, **kwargs):
+        async def attempt():
+            async with self._semaphore:
+                return await asyncio.to_thread(self._call, method, *args, **kwargs)
+
+        return await call_with_retry(
+            attempt,
+            retries=self.retries,
+            base_delay=self.backoff,
+            max_delay=self.max_backoff,
+            breaker=self.breaker,
+            retry_on=retry_on,
+            description=description
+        )
+
+    async def _create_page(self, title: str, content: List[Node]) -> str:
+        # 创建页面不是幂等的，只在限流或连接未建立时重试，避免产生重复页面
+        response = await self._request(
+            f"创建 Telegraph 页面 {title}", CONNECT_ERRORS,
+            'create_page', title=title, content=content
+        )
+        return response['path']
+
+    async def _edit_page(self, path: str, title: str, content: List[Node]) -> None:
+        await self._request(
+            f"编辑 Telegraph 页面 {path}", TRANSIENT_ERRORS,
+            'edit_page', path, title=title, content=content
+        )
+
+    def _navigation(self, paths: List[str], index_path: str, idx: int) -> dict:
+        links = []
+        if idx > 0:
+            links.append(tag('a', '« 上一页', href=f"/{paths[idx - 1]}"))
+        links.append(tag('a', f"目录 ({idx + 1}/{len(paths)})", href=f"/{index_path}"))
+        if idx < len(paths) - 1:
+            links.append(tag('a', '下一页 »', href=f"/{paths[idx + 1]}"))
+
+        children = []
+        for link in links:
+            if children:
+                children.append(' | ')
+            children.append(link)
+        return tag('p', *children)
+
+    async def publish(self, messages) -> str:
+        """发布消息记录，返回文章（或目录页）链接"""
+        pages = self.split(messages)
+        if len(pages) == 1:
+            path = await self._create_page(self.title, pages[0])
+            return f"https://telegra.ph/{path}"
+
+        logger.info(f"内容超过单页限制，拆分为 {len(pages)} 页")
+        titles = [f"{self.title} ({idx + 1}/{len(pages)})" for idx in range(len(pages))]
+
+        # 先创建占位页面拿到各页路径，再写入带导航的正文，请求数由信号量限制
+        placeholder = [tag('p', '...')]
+        index_path, *paths = await asyncio.gather(
+            self._create_page(self.title, placeholder),
+            *(self._create_page(title, placeholder) for title in titles)
+        )
+
+        index_content = [
+            tag('h3', self.title),
+            tag('p', f"共 {len(pages)} 页"),
+            tag('ol', *(tag('li', tag('a', title, href=f"/{path}")) for title, path in zip(titles, paths)))
+        ]
+        edits = [self._edit_page(index_path, self.title, index_content)]
+        for idx, (path, title, content) in enumerate(zip(paths, titles, pages)):
+            navigation = self._navigation(paths, index_path, idx)
+            edits.append(self._edit_page(path, title, [navigation, *content, navigation]))
+        await asyncio.gather(*edits)
+
+        return f"https://telegra.ph/{index_path}"
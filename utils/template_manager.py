@@ -1,24 +1,66 @@
 import os
-from jinja2 import Environment, FileSystemLoader, select_autoescape
+import sys
+import logging
+from jinja2 import (
+    Environment, FileSystemLoader, ModuleLoader, ChoiceLoader,
+    FileSystemBytecodeCache, select_autoescape
+)
+
+logger = logging.getLogger(__name__)
 
 class TemplateManager:
-    def __init__(self, templates_dir='templates'):
+    """
+    模板管理器，应在进程内共享一个实例
+    模板只在启动时编译一次，字节码缓存到磁盘；开启 auto_reload 时模板文件修改后自动重新加载
+    """
+
+    TEMPLATES = ('wechat_template.html',)
+
+    def __init__(self, templates_dir='templates', bytecode_cache_dir=None, compiled_dir=None, auto_reload=True):
+        """
+        :param templates_dir: 模板目录
+        :param bytecode_cache_dir: 字节码缓存目录，为空时使用系统临时目录
+        :param compiled_dir: 预编译模板的模块目录，仅在关闭 auto_reload 时优先使用
+        :param auto_reload: 模板文件变化时是否重新加载
+        """
+        loader = FileSystemLoader(templates_dir)
+        if compiled_dir and not auto_reload and os.path.isdir(compiled_dir):
+            logger.info(f"使用预编译模板: {compiled_dir}")
+            loader = ChoiceLoader([ModuleLoader(compiled_dir), loader])
+
+        if bytecode_cache_dir:
+            os.makedirs(bytecode_cache_dir, exist_ok=True)
+            bytecode_cache = FileSystemBytecodeCache(bytecode_cache_dir)
+        else:
+            bytecode_cache = FileSystemBytecodeCache()
+
         self.env = Environment(
-            loader=FileSystemLoader(templates_dir),
-            autoescape=select_autoescape(['html'])
+            loader=loader,
+            autoescape=select_autoescape(['html']),
+            bytecode_cache=bytecode_cache,
+            auto_reload=auto_reload
         )
-    
-    def render_telegraph_template(self, messages):
-        template = self.env.get_template('telegraph/message_record.html')
-        return template.render(messages=messages)
-    
+
+    def precompile(self):
+        """启动时加载并编译所有模板"""
+        for name in self.TEMPLATES:
+            self.env.get_template(name)
+
+    def compile_to(self, target_dir):
+        """把模板预编译为 Python 模块，供 ModuleLoader 加载以加快冷启动"""
+        self.env.compile_templates(target_dir, zip=None, filter_func=lambda name: name in self.TEMPLATES)
+
     def render_wechat_template(self, messages):
         template = self.env.get_template('wechat_template.html')
-        
-        # 处理消息中的 GIF
-        for msg in messages:
-            if msg['type'] == 'photo' and msg['content'].endswith('.gif'):
-                # 为 GIF 添加特殊标记
-                msg['is_gif'] = True
-        
-        return template.render(messages=messages) 
\ No newline at end of file
+        # GIF 标记由 RecordedMessage.is_gif 提供，无需修改消息
+        return template.render(messages=messages)
+
+    def render_wechat_to_file(self, messages, fp):
+        """流式渲染微信文章，逐块写入文件，不生成完整的 HTML 字符串"""
+        template = self.env.get_template('wechat_template.html')
+        for chunk in template.generate(messages=messages):
+            fp.write(chunk)
+
+if __name__ == '__main__':
+    # 用法: python -m utils.template_manager <输出目录>
+    TemplateManager().compile_to(sys.argv[1] if len(sys.argv) > 1 else 'templates_compiled')
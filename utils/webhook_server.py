@@ -0,0 +1,76 @@
+import hmac
+import logging
+from typing import Optional
+
+from aiohttp import web
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+
+class WebhookServer:
+    """
+    基于 aiohttp 的 webhook 接收服务
+    校验 Telegram 的 secret token 后把 update 放入 Application 的队列，另提供健康检查接口
+    只支持单副本部署：会话、消息顺序、相册聚合和后台任务的状态都在进程内，
+    多个副本会各自看到一部分 update，导致会话丢失、相册被拆分
+    """
+
+    SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+    def __init__(self, application, listen: str = '0.0.0.0', port: int = 8080,
+                 path: str = '/telegram', secret_token: str = '', health_path: str = '/healthz'):
+        """
+        :param application: telegram.ext.Application
+        :param listen: 监听地址
+        :param port: 监听端口
+        :param path: 接收 update 的路径
+        :param secret_token: 与 setWebhook 时一致的 secret token
+        :param health_path: 健康检查路径
+        """
+        if not secret_token:
+            raise ValueError("webhook 服务需要 secret token")
+        self.application = application
+        self.listen = listen
+        self.port = port
+        self.path = path
+        self.secret_token = secret_token
+        self.health_path = health_path
+        self._runner: Optional[web.AppRunner] = None
+
+        self.app = web.Application()
+        self.app.router.add_post(self.path, self._handle_update)
+        self.app.router.add_get(self.health_path, self._handle_health)
+
+    async def _handle_update(self, request: web.Request) -> web.Response:
+        token = request.headers.get(self.SECRET_HEADER, '')
+        if not hmac.compare_digest(token.encode('utf-8'), self.secret_token.encode('utf-8')):
+            logger.warning(f"拒绝 secret token 不匹配的 webhook 请求: {request.remote}")
+            return web.Response(status=403)
+
+        try:
+            data = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+
+        update = Update.de_json(data, self.application.bot)
+        await self.application.update_queue.put(update)
+        return web.Response()
+
+    async def _handle_health(self, request: web.Request) -> web.Response:
+        running = self.application.running
+        return web.json_response(
+            {'status': 'ok' if running else 'starting', 'pending_updates': self.application.update_queue.qsize()},
+            status=200 if running else 503
+        )
+
+    async def start(self) -> None:
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.listen, self.port).start()
+        logger.info(f"Webhook 服务已启动: {self.listen}:{self.port}{self.path}")
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None